@@ -1,7 +1,10 @@
+import bz2
 import os
 import tempfile
 import contextlib
-from typing import Optional
+from typing import IO, BinaryIO, Optional
+
+COMPRESS_CHUNK_SIZE = 1024 * 1024
 
 
 class CallbackReader:
@@ -23,6 +26,22 @@ class CallbackReader:
     return chunk
 
 
+def bz2_compress_to_tempfile(f: BinaryIO, tmp_dir: Optional[str] = None, chunk_size: int = COMPRESS_CHUNK_SIZE) -> IO[bytes]:
+  """Compress a file into an anonymous temporary file one chunk at a time, so memory use does not
+  grow with the file size. The returned file is rewound, knows its size for Content-Length and is deleted on close."""
+  tmp = tempfile.TemporaryFile(dir=tmp_dir)
+  try:
+    compressor = bz2.BZ2Compressor()
+    while chunk := f.read(chunk_size):
+      tmp.write(compressor.compress(chunk))
+    tmp.write(compressor.flush())
+    tmp.seek(0)
+  except BaseException:
+    tmp.close()
+    raise
+  return tmp
+
+
 @contextlib.contextmanager
 def atomic_write_in_dir(path: str, mode: str = 'w', buffering: int = -1, encoding: Optional[str] = None, newline: Optional[str] = None,
                         overwrite: bool = False):
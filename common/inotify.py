@@ -0,0 +1,78 @@
+"""Minimal inotify bindings for watching a single directory."""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+from typing import List, Optional, Tuple
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[];}
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+class DirectoryWatcher:
+  """Reports the names of files in a directory that had one of the events in mask.
+  Raises OSError if inotify is not available on this platform."""
+  def __init__(self, path: str, mask: int):
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+      raise OSError(errno.ENOSYS, "inotify is not available")
+
+    self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+      err = ctypes.get_errno()
+      os.close(self.fd)
+      raise OSError(err, f"inotify_add_watch failed for {path}")
+
+  def read(self, timeout: float = 0.) -> Optional[List[Tuple[int, str]]]:
+    """Returns (mask, name) of the events since the last call, waiting up to timeout seconds for one.
+    Returns None if the kernel queue overflowed and events were lost, the directory should be rescanned."""
+    if not select.select([self.fd], [], [], timeout)[0]:
+      return []
+
+    events = []
+    overflow = False
+    while True:
+      try:
+        buf = os.read(self.fd, _READ_SIZE)
+      except BlockingIOError:
+        break
+
+      offset = 0
+      while offset < len(buf):
+        _, mask, _, name_len = _EVENT.unpack_from(buf, offset)
+        offset += _EVENT.size
+        name = buf[offset:offset + name_len].rstrip(b"\0")
+        offset += name_len
+
+        overflow |= bool(mask & IN_Q_OVERFLOW)
+        if name:
+          events.append((mask, os.fsdecode(name)))
+    return None if overflow else events
+
+  def close(self) -> None:
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
+
+  def __enter__(self) -> 'DirectoryWatcher':
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
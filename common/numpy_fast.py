@@ -1,19 +1,51 @@
+from bisect import bisect_left
+import numpy as np
+
+
 def clip(x, lo, hi):
+  if isinstance(x, np.ndarray):
+    return np.clip(x, lo, hi)
   return max(lo, min(hi, x))
 
-def interp(x, xp, fp):
+
+def _interp_scalar(xv, xp, fp):
+  # xp needs to be increasing, the first index with xp[hi] >= xv
+  hi = bisect_left(xp, xv)
+  if hi == len(xp):
+    return fp[-1]
+  elif hi == 0:
+    return fp[0]
+  low = hi - 1
+  return (xv - xp[low]) * (fp[hi] - fp[low]) / (xp[hi] - xp[low]) + fp[low]
+
+
+def _interp_array(x, xp, fp):
+  # Same as _interp_scalar for every element, returns the same values bit for bit
+  x = np.asarray(x, dtype=np.float64)
+  xp = np.asarray(xp, dtype=np.float64)
+  fp = np.asarray(fp, dtype=np.float64)
   N = len(xp)
 
-  def get_interp(xv):
-    hi = 0
-    while hi < N and xv > xp[hi]:
-      hi += 1
-    low = hi - 1
-    return fp[-1] if hi == N and xv > xp[low] else (
-      fp[0] if hi == 0 else
-      (xv - xp[low]) * (fp[hi] - fp[low]) / (xp[hi] - xp[low]) + fp[low])
+  # NaN is below the range like in _interp_scalar
+  hi = np.atleast_1d(np.searchsorted(xp, x, side='left'))
+  hi[np.atleast_1d(np.isnan(x))] = 0
+  inside = (hi > 0) & (hi < N)
+  out = np.where(hi == 0, fp[0], fp[-1])
+
+  xv, hi = np.atleast_1d(x)[inside], hi[inside]
+  low = hi - 1
+  out[inside] = (xv - xp[low]) * (fp[hi] - fp[low]) / (xp[hi] - xp[low]) + fp[low]
+  return out.reshape(x.shape)
+
+
+def interp(x, xp, fp):
+  # arrays are interpolated at once, but still return a list like other iterables
+  if isinstance(x, np.ndarray):
+    return _interp_array(x, xp, fp).tolist()
+  elif hasattr(x, '__iter__'):
+    return [_interp_scalar(v, xp, fp) for v in x]
+  return _interp_scalar(x, xp, fp)
 
-  return [get_interp(v) for v in x] if hasattr(x, '__iter__') else get_interp(x)
 
 def mean(x):
   return sum(x) / len(x)
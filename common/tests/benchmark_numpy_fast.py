@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import timeit
+import numpy as np
+
+from openpilot.common.numpy_fast import interp
+from openpilot.selfdrive.modeld.constants import ModelConstants
+
+N_RUNS = 10000
+CONTROL_N = 17
+T_IDXS_CONTROL = ModelConstants.T_IDXS[:CONTROL_N]
+
+
+def interp_linear_scan(x, xp, fp):
+  # interp before binary search, for comparison
+  N = len(xp)
+
+  def get_interp(xv):
+    hi = 0
+    while hi < N and xv > xp[hi]:
+      hi += 1
+    low = hi - 1
+    return fp[-1] if hi == N and xv > xp[low] else (
+      fp[0] if hi == 0 else
+      (xv - xp[low]) * (fp[hi] - fp[low]) / (xp[hi] - xp[low]) + fp[low])
+
+  return [get_interp(v) for v in x] if hasattr(x, '__iter__') else get_interp(x)
+
+
+# (name, x, xp, fp) of typical calls
+CALL_SITES = [
+  # controls
+  ("pid gain", 12.0, [0., 5., 35.], [3.6, 2.4, 1.5]),
+  ("get_friction", 0.1, [-0.3, 0.3], [-0.1, 0.1]),
+  ("longcontrol target", 0.3, T_IDXS_CONTROL, np.linspace(20., 22., CONTROL_N).tolist()),
+  # planners
+  ("get_max_accel", 17.0, [0., 10.0, 25., 40.], [1.6, 1.2, 0.8, 0.6]),
+  ("a_desired", 0.05, T_IDXS_CONTROL, np.linspace(0., 1., CONTROL_N)),
+  ("plan over T_IDXS", np.array(ModelConstants.T_IDXS), [0., 2., 4., 6., 8., 10.], [0., 10., 18., 24., 28., 30.]),
+  ("1000 points", np.linspace(-1., 11., 1000), ModelConstants.T_IDXS, ModelConstants.X_IDXS),
+  # car interfaces
+  ("honda wind_brake", 20.0, [0.0, 2.3, 35.0], [0.001, 0.002, 0.15]),
+  ("toyota pedal scale", 8.0, [0.0, 9.0, 12.0], [0.15, 0.3, 0.0]),
+  ("gm gas lookup", -1.0, np.array([-3.5, 0., 2.]), np.array([1000., 1100., 1600.])),
+]
+
+
+if __name__ == "__main__":
+  print(f"{N_RUNS} calls each")
+  for name, x, xp, fp in CALL_SITES:
+    np.testing.assert_equal(interp(x, xp, fp), interp_linear_scan(x, xp, fp))
+    new_us = timeit.timeit(lambda x=x, xp=xp, fp=fp: interp(x, xp, fp), number=N_RUNS) / N_RUNS * 1e6
+    old_us = timeit.timeit(lambda x=x, xp=xp, fp=fp: interp_linear_scan(x, xp, fp), number=N_RUNS) / N_RUNS * 1e6
+    print(f"{name}: {new_us:.2f} us, linear scan {old_us:.2f} us, {old_us / new_us:.1f}x")
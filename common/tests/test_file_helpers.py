@@ -1,8 +1,10 @@
+import bz2
+import io
 import os
 import unittest
 from uuid import uuid4
 
-from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.common.file_helpers import atomic_write_in_dir, bz2_compress_to_tempfile
 
 
 class TestFileHelpers(unittest.TestCase):
@@ -19,6 +21,11 @@ class TestFileHelpers(unittest.TestCase):
   def test_atomic_write_in_dir(self):
     self.run_atomic_write_func(atomic_write_in_dir)
 
+  def test_bz2_compress_to_tempfile(self):
+    data = os.urandom(1024 * 100) + b"\0" * 1024 * 500
+    with bz2_compress_to_tempfile(io.BytesIO(data), chunk_size=4096) as f:
+      self.assertEqual(f.read(), bz2.compress(data))
+
 
 if __name__ == "__main__":
   unittest.main()
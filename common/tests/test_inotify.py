@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from openpilot.common.inotify import DirectoryWatcher, IN_CLOSE_WRITE, IN_MOVED_TO
+
+
+class TestInotify(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def test_directory_watcher(self):
+    with DirectoryWatcher(self.path, IN_CLOSE_WRITE | IN_MOVED_TO) as watcher:
+      self.assertEqual(watcher.read(), [])
+
+      with open(os.path.join(self.path, "written"), "w") as f:
+        f.write("test")
+      with tempfile.NamedTemporaryFile(dir=self.path, delete=False) as f:
+        tmp_name = f.name
+      os.replace(tmp_name, os.path.join(self.path, "moved"))
+      os.remove(os.path.join(self.path, "written"))
+
+      events = watcher.read(timeout=1.)
+      self.assertEqual([name for _, name in events], ["written", os.path.basename(tmp_name), "moved"])
+      self.assertEqual(events[-1][0] & IN_MOVED_TO, IN_MOVED_TO)
+      self.assertEqual(watcher.read(), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,7 +1,7 @@
 import numpy as np
 import unittest
 
-from openpilot.common.numpy_fast import interp
+from openpilot.common.numpy_fast import clip, interp
 
 
 class InterpTest(unittest.TestCase):
@@ -21,6 +21,22 @@ class InterpTest(unittest.TestCase):
       actual = interp(v_ego, _A_CRUISE_MIN_BP, _A_CRUISE_MIN_V)
       np.testing.assert_equal(actual, expected)
 
+  def test_array_matches_scalar(self):
+    xp = [-1., 0., 0., 2.5, 10.]
+    fp = [3., -1., 2., 0.5, 7.]
+    x = np.array([-5., -1., -0.5, 0., 1e-9, 1., 2.5, 9.99, 10., 11., np.inf, -np.inf, np.nan])
+
+    actual = interp(x, xp, fp)
+    self.assertIsInstance(actual, list)
+    np.testing.assert_array_equal(actual, [interp(v, xp, fp) for v in x])
+    np.testing.assert_array_equal(interp(x.reshape(-1, 1), xp, fp), np.reshape(actual, (-1, 1)))
+    np.testing.assert_array_equal(interp(x, np.array(xp), np.array(fp)), actual)
+
+  def test_clip(self):
+    self.assertEqual(clip(5, 0, 1), 1)
+    self.assertEqual(clip(-5, 0, 1), 0)
+    np.testing.assert_array_equal(clip(np.array([-2., 0.5, 3.]), 0., 1.), [0., 0.5, 1.])
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+import time
+import numpy as np
+
+from openpilot.common.transformations import coordinates, orientation
+from openpilot.common.transformations import transformations
+
+N_POINTS = int(1e6)
+
+
+def per_row(function):
+  # how inputs were converted before the batch functions, one call per row
+  return lambda *args: np.asarray([function(*args[:-1], i) for i in args[-1]])
+
+
+if __name__ == "__main__":
+  rng = np.random.default_rng(0)
+  euler = rng.uniform(-np.pi, np.pi, (N_POINTS, 3))
+  geodetic = np.column_stack([rng.uniform(-90, 90, N_POINTS), rng.uniform(-180, 180, N_POINTS), rng.uniform(0, 3000, N_POINTS)])
+  ecef = coordinates.geodetic2ecef(geodetic)
+  local_coord = coordinates.LocalCoord.from_geodetic(geodetic[0])
+
+  benchmarks = [
+    ("euler2rot", orientation.euler2rot, transformations.euler2rot_single, (euler,)),
+    ("euler2quat", orientation.euler2quat, transformations.euler2quat_single, (euler,)),
+    ("quat2rot", orientation.quat2rot, transformations.quat2rot_single, (orientation.euler2quat(euler),)),
+    ("rot2euler", orientation.rot2euler, transformations.rot2euler_single, (orientation.euler2rot(euler),)),
+    ("ecef2geodetic", coordinates.ecef2geodetic, transformations.ecef2geodetic_single, (ecef,)),
+    ("geodetic2ecef", coordinates.geodetic2ecef, transformations.geodetic2ecef_single, (geodetic,)),
+    ("LocalCoord.ecef2ned", coordinates.LocalCoord.ecef2ned, transformations.LocalCoord.ecef2ned_single, (local_coord, ecef)),
+  ]
+
+  print(f"{N_POINTS:.0e} points")
+  for name, batch_function, single_function, args in benchmarks:
+    t = time.perf_counter()
+    batch_function(*args)
+    batch_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    per_row(single_function)(*args)
+    per_row_time = time.perf_counter() - t
+    print(f"{name}: {batch_time:.3f}s batch, {per_row_time:.3f}s per row, {per_row_time / batch_time:.1f}x")
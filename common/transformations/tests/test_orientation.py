@@ -6,6 +6,8 @@ import unittest
 from openpilot.common.transformations.orientation import euler2quat, quat2euler, euler2rot, rot2euler, \
                                                rot2quat, quat2rot, \
                                                ned_euler_from_ecef
+from openpilot.common.transformations.transformations import euler2quat_single, quat2euler_single, euler2rot_single, \
+                                                             rot2euler_single, quat2rot_single, rot2quat_single
 
 eulers = np.array([[ 1.46520501,  2.78688383,  2.92780854],
        [ 4.86909526,  3.60618161,  4.30648981],
@@ -63,6 +65,13 @@ class TestOrientation(unittest.TestCase):
       #np.testing.assert_allclose(eulers[i], ecef_euler_from_ned(ecef_positions[i], ned_eulers[i]), rtol=1e-7)
     # np.testing.assert_allclose(ned_eulers, ned_euler_from_ecef(ecef_positions, eulers), rtol=1e-7)
 
+  def test_batch_matches_single(self):
+    rots = euler2rot(eulers)
+    for batch, single, inputs in [(euler2quat, euler2quat_single, eulers), (quat2euler, quat2euler_single, quats),
+                                  (euler2rot, euler2rot_single, eulers), (rot2euler, rot2euler_single, rots),
+                                  (quat2rot, quat2rot_single, quats), (rot2quat, rot2quat_single, rots)]:
+      np.testing.assert_array_equal(batch(inputs), [single(inp) for inp in inputs])
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -54,6 +54,22 @@ cdef Geodetic list2geodetic(geodetic):
     g.alt = geodetic[2]
     return g
 
+cdef Matrix3 rows2matrix(const double[:, ::1] m):
+    # Matrix3 is column major
+    cdef double data[9]
+    cdef int r, c
+    for r in range(3):
+        for c in range(3):
+            data[3 * c + r] = m[r, c]
+    return Matrix3(data)
+
+cdef void matrix2rows(Matrix3 m, double[:, ::1] out):
+    cdef int r, c
+    for r in range(3):
+        for c in range(3):
+            out[r, c] = m(r, c)
+
+
 def euler2quat_single(euler):
     cdef Vector3 e = Vector3(euler[0], euler[1], euler[2])
     cdef Quaternion q = euler2quat_c(e)
@@ -112,6 +128,124 @@ def ecef2geodetic_single(ecef):
     return [g.lat, g.lon, g.alt]
 
 
+# Batched versions of the functions above, they take C contiguous arrays
+# of inputs and write each result into the preallocated out array
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def euler2quat_batch(const double[:, ::1] euler, double[:, ::1] out):
+    cdef Py_ssize_t i
+    cdef Quaternion q
+    for i in range(euler.shape[0]):
+        q = euler2quat_c(Vector3(euler[i, 0], euler[i, 1], euler[i, 2]))
+        out[i, 0] = q.w()
+        out[i, 1] = q.x()
+        out[i, 2] = q.y()
+        out[i, 3] = q.z()
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def quat2euler_batch(const double[:, ::1] quat, double[:, ::1] out):
+    cdef Py_ssize_t i
+    cdef Vector3 e
+    for i in range(quat.shape[0]):
+        e = quat2euler_c(Quaternion(quat[i, 0], quat[i, 1], quat[i, 2], quat[i, 3]))
+        out[i, 0] = e(0)
+        out[i, 1] = e(1)
+        out[i, 2] = e(2)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def quat2rot_batch(const double[:, ::1] quat, double[:, :, ::1] out):
+    cdef Py_ssize_t i
+    for i in range(quat.shape[0]):
+        matrix2rows(quat2rot_c(Quaternion(quat[i, 0], quat[i, 1], quat[i, 2], quat[i, 3])), out[i])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rot2quat_batch(const double[:, :, ::1] rot, double[:, ::1] out):
+    cdef Py_ssize_t i
+    cdef Quaternion q
+    for i in range(rot.shape[0]):
+        q = rot2quat_c(rows2matrix(rot[i]))
+        out[i, 0] = q.w()
+        out[i, 1] = q.x()
+        out[i, 2] = q.y()
+        out[i, 3] = q.z()
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def euler2rot_batch(const double[:, ::1] euler, double[:, :, ::1] out):
+    cdef Py_ssize_t i
+    for i in range(euler.shape[0]):
+        matrix2rows(euler2rot_c(Vector3(euler[i, 0], euler[i, 1], euler[i, 2])), out[i])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rot2euler_batch(const double[:, :, ::1] rot, double[:, ::1] out):
+    cdef Py_ssize_t i
+    cdef Vector3 e
+    for i in range(rot.shape[0]):
+        e = rot2euler_c(rows2matrix(rot[i]))
+        out[i, 0] = e(0)
+        out[i, 1] = e(1)
+        out[i, 2] = e(2)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ecef_euler_from_ned_batch(ecef_init, const double[:, ::1] ned_pose, double[:, ::1] out):
+    cdef ECEF init = list2ecef(ecef_init)
+    cdef Py_ssize_t i
+    cdef Vector3 e
+    for i in range(ned_pose.shape[0]):
+        e = ecef_euler_from_ned_c(init, Vector3(ned_pose[i, 0], ned_pose[i, 1], ned_pose[i, 2]))
+        out[i, 0] = e(0)
+        out[i, 1] = e(1)
+        out[i, 2] = e(2)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ned_euler_from_ecef_batch(ecef_init, const double[:, ::1] ecef_pose, double[:, ::1] out):
+    cdef ECEF init = list2ecef(ecef_init)
+    cdef Py_ssize_t i
+    cdef Vector3 e
+    for i in range(ecef_pose.shape[0]):
+        e = ned_euler_from_ecef_c(init, Vector3(ecef_pose[i, 0], ecef_pose[i, 1], ecef_pose[i, 2]))
+        out[i, 0] = e(0)
+        out[i, 1] = e(1)
+        out[i, 2] = e(2)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def geodetic2ecef_batch(const double[:, ::1] geodetic, double[:, ::1] out):
+    cdef Py_ssize_t i
+    cdef Geodetic g
+    cdef ECEF e
+    for i in range(geodetic.shape[0]):
+        g.lat = geodetic[i, 0]
+        g.lon = geodetic[i, 1]
+        g.alt = geodetic[i, 2]
+        e = geodetic2ecef_c(g)
+        out[i, 0] = e.x
+        out[i, 1] = e.y
+        out[i, 2] = e.z
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ecef2geodetic_batch(const double[:, ::1] ecef, double[:, ::1] out):
+    cdef Py_ssize_t i
+    cdef ECEF e
+    cdef Geodetic g
+    for i in range(ecef.shape[0]):
+        e.x = ecef[i, 0]
+        e.y = ecef[i, 1]
+        e.z = ecef[i, 2]
+        g = ecef2geodetic_c(e)
+        out[i, 0] = g.lat
+        out[i, 1] = g.lon
+        out[i, 2] = g.alt
+
+
 cdef class LocalCoord:
     cdef LocalCoord_c * lc
 
@@ -170,5 +304,69 @@ cdef class LocalCoord:
         cdef Geodetic g = self.lc.ned2geodetic(n)
         return [g.lat, g.lon, g.alt]
 
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ecef2ned_batch(self, const double[:, ::1] ecef, double[:, ::1] out):
+        assert self.lc
+        cdef Py_ssize_t i
+        cdef ECEF e
+        cdef NED n
+        for i in range(ecef.shape[0]):
+            e.x = ecef[i, 0]
+            e.y = ecef[i, 1]
+            e.z = ecef[i, 2]
+            n = self.lc.ecef2ned(e)
+            out[i, 0] = n.n
+            out[i, 1] = n.e
+            out[i, 2] = n.d
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ned2ecef_batch(self, const double[:, ::1] ned, double[:, ::1] out):
+        assert self.lc
+        cdef Py_ssize_t i
+        cdef NED n
+        cdef ECEF e
+        for i in range(ned.shape[0]):
+            n.n = ned[i, 0]
+            n.e = ned[i, 1]
+            n.d = ned[i, 2]
+            e = self.lc.ned2ecef(n)
+            out[i, 0] = e.x
+            out[i, 1] = e.y
+            out[i, 2] = e.z
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def geodetic2ned_batch(self, const double[:, ::1] geodetic, double[:, ::1] out):
+        assert self.lc
+        cdef Py_ssize_t i
+        cdef Geodetic g
+        cdef NED n
+        for i in range(geodetic.shape[0]):
+            g.lat = geodetic[i, 0]
+            g.lon = geodetic[i, 1]
+            g.alt = geodetic[i, 2]
+            n = self.lc.geodetic2ned(g)
+            out[i, 0] = n.n
+            out[i, 1] = n.e
+            out[i, 2] = n.d
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ned2geodetic_batch(self, const double[:, ::1] ned, double[:, ::1] out):
+        assert self.lc
+        cdef Py_ssize_t i
+        cdef NED n
+        cdef Geodetic g
+        for i in range(ned.shape[0]):
+            n.n = ned[i, 0]
+            n.e = ned[i, 1]
+            n.d = ned[i, 2]
+            g = self.lc.ned2geodetic(n)
+            out[i, 0] = g.lat
+            out[i, 1] = g.lon
+            out[i, 2] = g.alt
+
     def __dealloc__(self):
         del self.lc
@@ -2,7 +2,6 @@
 from __future__ import annotations
 
 import base64
-import bz2
 import hashlib
 import io
 import json
@@ -15,11 +14,12 @@ import sys
 import tempfile
 import threading
 import time
+from bisect import bisect_left
 from dataclasses import asdict, dataclass, replace
 from datetime import datetime
 from functools import partial
 from queue import Queue
-from typing import Callable, Dict, List, Optional, Set, Union, cast
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union, cast
 
 import requests
 from jsonrpc import JSONRPCResponseManager, dispatcher
@@ -30,7 +30,8 @@ import cereal.messaging as messaging
 from cereal import log
 from cereal.services import SERVICE_LIST
 from openpilot.common.api import Api
-from openpilot.common.file_helpers import CallbackReader
+from openpilot.common.file_helpers import CallbackReader, bz2_compress_to_tempfile
+from openpilot.common.inotify import IN_CLOSE_WRITE, IN_MOVED_TO, DirectoryWatcher
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware import HARDWARE, PC
@@ -53,6 +54,10 @@ MAX_RETRY_COUNT = 30  # Try for at most 5 minutes if upload fails immediately
 MAX_AGE = 31 * 24 * 3600  # seconds
 WS_FRAME_SIZE = 4096
 
+MAX_FORWARD_BATCH_SIZE = 1024 * 1024  # bytes of logs or stats sent in one forwardLogs or storeStats call
+DIR_RESCAN_INTERVAL = 3600  # seconds, also resends logs whose forwardLogs response was lost
+DIR_SCAN_INTERVAL = 10  # seconds, when inotify isn't available
+
 NetworkType = log.DeviceState.NetworkType
 
 UploadFileDict = Dict[str, Union[str, int, float, bool]]
@@ -267,6 +272,10 @@ def upload_handler(end_event: threading.Event) -> None:
       except AbortTransferException:
         cloudlog.event("athena.upload_handler.abort", fn=fn, sz=sz, network_type=network_type, metered=metered)
         retry_upload(tid, end_event, False)
+      except OSError as e:
+        # reading the file or writing its compressed copy failed, e.g. ENOSPC on a full log partition
+        cloudlog.event("athena.upload_handler.upload_failed", reason=str(e), fn=fn, sz=sz, network_type=network_type, metered=metered)
+        retry_upload(tid, end_event)
 
     except queue.Empty:
       pass
@@ -284,16 +293,19 @@ def _do_upload(upload_item: UploadItem, callback: Optional[Callable] = None) ->
     compress = True
 
   with open(path, "rb") as f:
-    content = f.read()
     if compress:
       cloudlog.event("athena.upload_handler.compress", fn=path, fn_orig=upload_item.path)
-      content = bz2.compress(content)
+      # written to the log partition, which can be full until the deleter frees space
+      data = bz2_compress_to_tempfile(f, tmp_dir=os.path.dirname(path))
+    else:
+      data = f
 
-  with io.BytesIO(content) as data:
-    return requests.put(upload_item.url,
-                        data=CallbackReader(data, callback, len(content)) if callback else data,
-                        headers={**upload_item.headers, 'Content-Length': str(len(content))},
-                        timeout=30)
+    with data:
+      size = os.fstat(data.fileno()).st_size
+      return requests.put(upload_item.url,
+                          data=CallbackReader(data, callback, size) if callback else data,
+                          headers={**upload_item.headers, 'Content-Length': str(size)},
+                          timeout=30)
 
 
 # security: user should be able to request any message from their car
@@ -540,7 +552,6 @@ def takeSnapshot() -> Optional[Union[str, Dict[str, str]]]:
 
 
 def get_logs_to_send_sorted() -> List[str]:
-  # TODO: scan once then use inotify to detect file creation/deletion
   curr_time = int(time.time())
   logs = []
   for log_entry in os.listdir(Paths.swaglog_root()):
@@ -559,41 +570,102 @@ def get_logs_to_send_sorted() -> List[str]:
   return sorted(logs)[:-1]
 
 
+def watch_directory(path: str) -> Optional[DirectoryWatcher]:
+  # files are complete once they are closed after writing, or moved in by atomic_write_in_dir
+  try:
+    return DirectoryWatcher(path, IN_CLOSE_WRITE | IN_MOVED_TO)
+  except OSError as e:
+    # the handlers fall back to scanning the directory, and try again on their next scan
+    cloudlog.warning(f"athena.watch_directory.failed {path}: {e}")
+    return None
+
+
+def add_watched_files(watcher: Optional[DirectoryWatcher], files: List[str], timeout: float = 0.) -> bool:
+  """Adds newly completed files to the sorted list, returns False if the directory needs to be scanned."""
+  events = watcher.read(timeout) if watcher is not None else []
+  if events is None:
+    return False
+
+  for _, name in events:
+    i = bisect_left(files, name)
+    if i == len(files) or files[i] != name:
+      files.insert(i, name)
+  return True
+
+
+def read_files_batch(path: str, files: List[str]) -> Tuple[List[str], str]:
+  """Pops the newest files off the sorted list and reads them, up to MAX_FORWARD_BATCH_SIZE.
+  Returns the names read and their contents in chronological order."""
+  batch: List[str] = []
+  contents: List[str] = []
+  batch_size = 0
+  while len(files) > 0:
+    file_path = os.path.join(path, files[-1])
+    try:
+      sz = os.path.getsize(file_path)
+      if len(batch) > 0 and batch_size + sz > MAX_FORWARD_BATCH_SIZE:
+        break
+      with open(file_path) as f:
+        data = f.read()
+      # records are newline separated, a truncated last record mustn't run into the next file's first one
+      if len(data) > 0 and not data.endswith("\n"):
+        data += "\n"
+      contents.append(data)
+      batch.append(files[-1])
+      batch_size += sz
+    except OSError:
+      pass  # file could be deleted by log rotation
+    files.pop()
+  return batch, "".join(reversed(contents))
+
+
 def log_handler(end_event: threading.Event) -> None:
   if PC:
     return
 
-  log_files = []
-  last_scan = 0.
+  watcher: Optional[DirectoryWatcher] = None
+  log_files: List[str] = []
+  # forwardLogs request id -> logs sent in it
+  sent_batches: Dict[str, List[str]] = {}
+  last_scan: Optional[float] = None
   while not end_event.is_set():
     try:
       curr_scan = time.monotonic()
-      if curr_scan - last_scan > 10:
+      scan_interval = DIR_SCAN_INTERVAL if watcher is None else DIR_RESCAN_INTERVAL
+      if not add_watched_files(watcher, log_files) or last_scan is None or curr_scan - last_scan > scan_interval:
+        # watch before scanning, so files completed in between aren't missed
+        if watcher is None:
+          watcher = watch_directory(Paths.swaglog_root())
         log_files = get_logs_to_send_sorted()
         last_scan = curr_scan
 
-      # send one log
+      # send a batch of the newest logs
       curr_log = None
-      if len(log_files) > 0:
-        log_entry = log_files.pop() # newest log file
-        cloudlog.debug(f"athena.log_handler.forward_request {log_entry}")
-        try:
-          curr_time = int(time.time())
-          log_path = os.path.join(Paths.swaglog_root(), log_entry)
-          setxattr(log_path, LOG_ATTR_NAME, int.to_bytes(curr_time, 4, sys.byteorder))
-          with open(log_path) as f:
-            jsonrpc = {
-              "method": "forwardLogs",
-              "params": {
-                "logs": f.read()
-              },
-              "jsonrpc": "2.0",
-              "id": log_entry
-            }
-            low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
-            curr_log = log_entry
-        except OSError:
-          pass  # file could be deleted by log rotation
+      batch, logs = read_files_batch(Paths.swaglog_root(), log_files)
+      if len(batch) > 0:
+        curr_log = batch[0]
+        cloudlog.debug(f"athena.log_handler.forward_request {curr_log} {len(batch)}")
+        curr_time = int(time.time())
+        for log_entry in batch:
+          try:
+            setxattr(os.path.join(Paths.swaglog_root(), log_entry), LOG_ATTR_NAME, int.to_bytes(curr_time, 4, sys.byteorder))
+          except OSError:
+            pass  # file could be deleted by log rotation
+
+        jsonrpc = {
+          "method": "forwardLogs",
+          "params": {
+            "logs": logs
+          },
+          "jsonrpc": "2.0",
+          "id": curr_log
+        }
+        low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
+
+        # responses that never arrive are resent after an hour anyway
+        sent_batches[curr_log] = batch
+        if len(sent_batches) > 10:
+          del sent_batches[next(iter(sent_batches))]
 
       # wait for response up to ~100 seconds
       # always read queue at least once to process any old responses that arrive
@@ -606,11 +678,11 @@ def log_handler(end_event: threading.Event) -> None:
           log_success = "result" in log_resp and log_resp["result"].get("success")
           cloudlog.debug(f"athena.log_handler.forward_response {log_entry} {log_success}")
           if log_entry and log_success:
-            log_path = os.path.join(Paths.swaglog_root(), log_entry)
-            try:
-              setxattr(log_path, LOG_ATTR_NAME, LOG_ATTR_VALUE_MAX_UNIX_TIME)
-            except OSError:
-              pass  # file could be deleted by log rotation
+            for sent_entry in sent_batches.pop(log_entry, [log_entry]):
+              try:
+                setxattr(os.path.join(Paths.swaglog_root(), sent_entry), LOG_ATTR_NAME, LOG_ATTR_VALUE_MAX_UNIX_TIME)
+              except OSError:
+                pass  # file could be deleted by log rotation
           if curr_log == log_entry:
             break
         except queue.Empty:
@@ -620,32 +692,51 @@ def log_handler(end_event: threading.Event) -> None:
     except Exception:
       cloudlog.exception("athena.log_handler.exception")
 
+  if watcher is not None:
+    watcher.close()
+
 
 def stat_handler(end_event: threading.Event) -> None:
   STATS_DIR = Paths.stats_root()
+  watcher: Optional[DirectoryWatcher] = None
+  stat_filenames: List[str] = []
+  last_scan: Optional[float] = None
   while not end_event.is_set():
-    last_scan = 0.
-    curr_scan = time.monotonic()
     try:
-      if curr_scan - last_scan > 10:
-        stat_filenames = list(filter(lambda name: not name.startswith(tempfile.gettempprefix()), os.listdir(STATS_DIR)))
-        if len(stat_filenames) > 0:
-          stat_path = os.path.join(STATS_DIR, stat_filenames[0])
-          with open(stat_path) as f:
-            jsonrpc = {
-              "method": "storeStats",
-              "params": {
-                "stats": f.read()
-              },
-              "jsonrpc": "2.0",
-              "id": stat_filenames[0]
-            }
-            low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
-          os.remove(stat_path)
+      curr_scan = time.monotonic()
+      scan_interval = DIR_SCAN_INTERVAL if watcher is None else DIR_RESCAN_INTERVAL
+      if not add_watched_files(watcher, stat_filenames, timeout=1.) or last_scan is None or curr_scan - last_scan > scan_interval:
+        # watch before scanning, so files completed in between aren't missed
+        if watcher is None:
+          watcher = watch_directory(STATS_DIR)
+        stat_filenames = sorted(os.listdir(STATS_DIR))
         last_scan = curr_scan
+      stat_filenames = [name for name in stat_filenames if not name.startswith(tempfile.gettempprefix())]
+
+      batch, stats = read_files_batch(STATS_DIR, stat_filenames)
+      if len(batch) > 0:
+        jsonrpc = {
+          "method": "storeStats",
+          "params": {
+            "stats": stats
+          },
+          "jsonrpc": "2.0",
+          "id": batch[0]
+        }
+        low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
+        for stat_entry in batch:
+          try:
+            os.remove(os.path.join(STATS_DIR, stat_entry))
+          except OSError:
+            pass
     except Exception:
       cloudlog.exception("athena.stat_handler.exception")
-    time.sleep(0.1)
+
+    if watcher is None:
+      time.sleep(1)
+
+  if watcher is not None:
+    watcher.close()
 
 
 def ws_proxy_recv(ws: WebSocket, local_sock: socket.socket, ssock: socket.socket, end_event: threading.Event, global_end_event: threading.Event) -> None:
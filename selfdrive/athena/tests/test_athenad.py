@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 from functools import partial
+import errno
 import json
 import multiprocessing
 import os
@@ -12,7 +13,7 @@ import unittest
 from dataclasses import asdict, replace
 from datetime import datetime, timedelta
 from parameterized import parameterized
-from typing import Optional
+from typing import List, Optional
 
 from unittest import mock
 from websocket import ABNF
@@ -251,6 +252,28 @@ class TestAthenadMethods(unittest.TestCase):
       if retry:
         self.assertEqual(athenad.upload_queue.get().retry_count, 1)
 
+  @mock.patch.object(athenad, 'bz2_compress_to_tempfile', side_effect=OSError(errno.ENOSPC, "No space left on device"))
+  def test_upload_handler_compress_failed(self, mock_compress):
+    """When the compressed copy can't be written, e.g. on a full disk, the upload should be retried"""
+    fn = self._create_file('qlog')
+    item = athenad.UploadItem(path=f'{fn}.bz2', url="http://localhost:44444/qlog.bz2", headers={}, created_at=int(time.time()*1000), id='',
+                              allow_cellular=True)
+
+    end_event = threading.Event()
+    thread = threading.Thread(target=athenad.upload_handler, args=(end_event,))
+    thread.start()
+
+    athenad.upload_queue.put_nowait(item)
+    try:
+      self._wait_for_upload()
+      time.sleep(0.1)
+
+      mock_compress.assert_called_once()
+      self.assertEqual(athenad.upload_queue.qsize(), 1)
+      self.assertEqual(athenad.upload_queue.get().retry_count, 1)
+    finally:
+      end_event.set()
+
   def test_upload_handler_timeout(self):
     """When an upload times out or fails to connect it should be placed back in the queue"""
     fn = self._create_file('qlog.bz2')
@@ -452,6 +475,123 @@ class TestAthenadMethods(unittest.TestCase):
     sl = athenad.get_logs_to_send_sorted()
     self.assertListEqual(sl, fl[:-1])
 
+  def _respond_to_log_batch(self, resp: dict) -> None:
+    athenad.log_recv_queue.put_nowait(json.dumps({'result': {'success': 1}, 'id': resp['id'], 'jsonrpc': '2.0'}))
+
+  def _wait_for_logs_sent(self, log_files: List[str]) -> None:
+    with Timeout(5, 'logs were not marked as sent'):
+      while not all(os.getxattr(fn, athenad.LOG_ATTR_NAME) == athenad.LOG_ATTR_VALUE_MAX_UNIX_TIME for fn in log_files):
+        time.sleep(0.1)
+
+  @mock.patch.object(athenad, 'PC', False)
+  def test_log_handler(self):
+    shutil.rmtree(Paths.swaglog_root(), ignore_errors=True)
+    log_files = [self._create_file(f'swaglog.{i:010}', Paths.swaglog_root(), f'log{i}\n'.encode() * 3) for i in range(5)]
+
+    end_event = threading.Event()
+    thread = threading.Thread(target=athenad.log_handler, args=(end_event,))
+    thread.start()
+    try:
+      # the closed logs are sent in one batch in chronological order, named after the newest one
+      resp = json.loads(athenad.low_priority_send_queue.get(timeout=5))
+      self.assertEqual(resp['method'], 'forwardLogs')
+      self.assertEqual(resp['id'], 'swaglog.0000000003')
+      self.assertEqual(resp['params']['logs'], ''.join(f'log{i}\n' * 3 for i in range(4)))
+
+      # a successful response marks every log in the batch as sent, the active log is left alone
+      self._respond_to_log_batch(resp)
+      self._wait_for_logs_sent(log_files[:4])
+      self.assertNotIn(athenad.LOG_ATTR_NAME, os.listxattr(log_files[4]))
+    finally:
+      end_event.set()
+      thread.join()
+
+  @mock.patch.object(athenad, 'PC', False)
+  @mock.patch.object(athenad, 'MAX_FORWARD_BATCH_SIZE', 30)
+  def test_log_handler_batch_size(self):
+    shutil.rmtree(Paths.swaglog_root(), ignore_errors=True)
+    # 15 bytes each, two of them fit in a batch
+    log_files = [self._create_file(f'swaglog.{i:010}', Paths.swaglog_root(), f'log{i}\n'.encode() * 3) for i in range(6)]
+
+    end_event = threading.Event()
+    thread = threading.Thread(target=athenad.log_handler, args=(end_event,))
+    thread.start()
+    try:
+      # newest logs first, the next batch is sent once the previous one is acknowledged
+      for request_id, batch in [(4, [3, 4]), (2, [1, 2]), (0, [0])]:
+        resp = json.loads(athenad.low_priority_send_queue.get(timeout=5))
+        self.assertEqual(resp['id'], f'swaglog.{request_id:010}')
+        self.assertEqual(resp['params']['logs'], ''.join(f'log{i}\n' * 3 for i in batch))
+        self._respond_to_log_batch(resp)
+        self._wait_for_logs_sent([log_files[i] for i in batch])
+    finally:
+      end_event.set()
+      thread.join()
+
+  def test_read_files_batch_newlines(self):
+    shutil.rmtree(Paths.stats_root(), ignore_errors=True)
+    self._create_file('0_0', Paths.stats_root(), b'stat0\n')
+    self._create_file('1_0', Paths.stats_root(), b'stat1')  # truncated
+    self._create_file('2_0', Paths.stats_root(), b'stat2\n')
+
+    files = ['0_0', '1_0', '2_0']
+    batch, stats = athenad.read_files_batch(Paths.stats_root(), files)
+    self.assertEqual(batch, ['2_0', '1_0', '0_0'])
+    self.assertEqual(stats, 'stat0\nstat1\nstat2\n')
+    self.assertEqual(files, [])
+
+  def test_stat_handler(self):
+    shutil.rmtree(Paths.stats_root(), ignore_errors=True)
+    for i in range(3):
+      self._create_file(f'{i}_0', Paths.stats_root(), f'stat{i}\n'.encode())
+
+    end_event = threading.Event()
+    thread = threading.Thread(target=athenad.stat_handler, args=(end_event,))
+    thread.start()
+    try:
+      # existing stats are sent in one batch
+      resp = json.loads(athenad.low_priority_send_queue.get(timeout=5))
+      self.assertEqual(resp['method'], 'storeStats')
+      self.assertEqual(resp['params']['stats'], 'stat0\nstat1\nstat2\n')
+
+      # new stats are picked up without rescanning
+      self._create_file('3_0', Paths.stats_root(), b'stat3\n')
+      resp = json.loads(athenad.low_priority_send_queue.get(timeout=5))
+      self.assertEqual(resp['params']['stats'], 'stat3\n')
+
+      # sent stats are removed after they're queued
+      with Timeout(5, 'stats were not removed'):
+        while len(os.listdir(Paths.stats_root())) > 0:
+          time.sleep(0.1)
+    finally:
+      end_event.set()
+      thread.join()
+
+  def test_stat_handler_directory_created(self):
+    shutil.rmtree(Paths.stats_root(), ignore_errors=True)
+
+    watchers = []
+    watch_directory = athenad.watch_directory
+    def record_watch_directory(path):
+      watchers.append(watch_directory(path))
+      return watchers[-1]
+
+    end_event = threading.Event()
+    thread = threading.Thread(target=athenad.stat_handler, args=(end_event,))
+    with mock.patch.object(athenad, 'watch_directory', record_watch_directory):
+      thread.start()
+      try:
+        # the directory can't be watched until it exists, it's watched on the next scan after it's created
+        time.sleep(0.5)
+        self._create_file('0_0', Paths.stats_root(), b'stat0\n')
+        resp = json.loads(athenad.low_priority_send_queue.get(timeout=5))
+        self.assertEqual(resp['params']['stats'], 'stat0\n')
+        self.assertIsNone(watchers[0])
+        self.assertIsNotNone(watchers[-1])
+      finally:
+        end_event.set()
+        thread.join()
+
 
 if __name__ == '__main__':
   unittest.main()
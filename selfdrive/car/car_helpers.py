@@ -1,13 +1,14 @@
+import json
 import os
 import time
-from typing import Callable, Dict, List, Optional, Tuple
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from cereal import car
 from openpilot.common.params import Params
 from openpilot.common.basedir import BASEDIR
 from openpilot.system.version import is_comma_remote, is_tested_branch
-from openpilot.selfdrive.car.interfaces import get_interface_attr
-from openpilot.selfdrive.car.fingerprints import eliminate_incompatible_cars, all_legacy_fingerprint_cars
+from openpilot.selfdrive.car.fingerprints import ALL_FINGERPRINT_CARS_MASK, cars_from_mask, compatible_cars_mask
 from openpilot.selfdrive.car.vin import get_vin, is_valid_vin, VIN_UNKNOWN
 from openpilot.selfdrive.car.fw_versions import get_fw_versions_ordered, get_present_ecus, match_fw_to_car, set_obd_multiplexing
 from openpilot.common.swaglog import cloudlog
@@ -15,6 +16,7 @@ import cereal.messaging as messaging
 from openpilot.selfdrive.car import gen_empty_fingerprint
 
 FRAME_FINGERPRINT = 100  # 1s
+INTERFACE_NAMES_JSON = os.path.join(BASEDIR, "selfdrive", "car", "interface_names.json")
 
 EventName = car.CarEvent.EventName
 
@@ -42,44 +44,66 @@ def get_one_can(logcan):
       return can
 
 
+def load_interface(brand_name):
+  path = f'openpilot.selfdrive.car.{brand_name}'
+  CarInterface = __import__(path + '.interface', fromlist=['CarInterface']).CarInterface
+
+  if os.path.exists(BASEDIR + '/' + path.replace('.', '/') + '/carstate.py'):
+    CarState = __import__(path + '.carstate', fromlist=['CarState']).CarState
+  else:
+    CarState = None
+
+  if os.path.exists(BASEDIR + '/' + path.replace('.', '/') + '/carcontroller.py'):
+    CarController = __import__(path + '.carcontroller', fromlist=['CarController']).CarController
+  else:
+    CarController = None
+
+  return CarInterface, CarController, CarState
+
+
 def load_interfaces(brand_names):
   ret = {}
   for brand_name in brand_names:
-    path = f'openpilot.selfdrive.car.{brand_name}'
-    CarInterface = __import__(path + '.interface', fromlist=['CarInterface']).CarInterface
+    brand_interface = load_interface(brand_name)
+    for model_name in brand_names[brand_name]:
+      ret[model_name] = brand_interface
+  return ret
 
-    if os.path.exists(BASEDIR + '/' + path.replace('.', '/') + '/carstate.py'):
-      CarState = __import__(path + '.carstate', fromlist=['CarState']).CarState
-    else:
-      CarState = None
 
-    if os.path.exists(BASEDIR + '/' + path.replace('.', '/') + '/carcontroller.py'):
-      CarController = __import__(path + '.carcontroller', fromlist=['CarController']).CarController
-    else:
-      CarController = None
+class LazyInterfaces(Mapping):
+  """Maps car models to (CarInterface, CarController, CarState), importing a brand's modules on first lookup"""
+  def __init__(self, brand_names: Dict[str, List[str]]):
+    self.model_to_brand = {model_name: brand_name for brand_name, model_names in brand_names.items() for model_name in model_names}
+    self.brand_interfaces: Dict[str, Tuple[Any, Any, Any]] = {}
 
-    for model_name in brand_names[brand_name]:
-      ret[model_name] = (CarInterface, CarController, CarState)
-  return ret
+  def __getitem__(self, model_name):
+    brand_name = self.model_to_brand[model_name]
+    if brand_name not in self.brand_interfaces:
+      self.brand_interfaces[brand_name] = load_interface(brand_name)
+    return self.brand_interfaces[brand_name]
 
+  def __iter__(self):
+    return iter(self.model_to_brand)
 
-def _get_interface_names() -> Dict[str, List[str]]:
-  # returns a dict of brand name and its respective models
-  brand_names = {}
-  for brand_name, brand_models in get_interface_attr("CAR").items():
-    brand_names[brand_name] = [model.value for model in brand_models]
+  def __len__(self):
+    return len(self.model_to_brand)
 
-  return brand_names
+
+def _get_interface_names() -> Dict[str, List[str]]:
+  # returns a dict of brand name and its respective models, generated by gen_interface_names.py
+  with open(INTERFACE_NAMES_JSON) as f:
+    return json.load(f)
 
 
-# imports from directory selfdrive/car/<name>/
+# imports from directory selfdrive/car/<name>/ when a model is looked up
 interface_names = _get_interface_names()
-interfaces = load_interfaces(interface_names)
+interfaces = LazyInterfaces(interface_names)
 
 
 def can_fingerprint(next_can: Callable) -> Tuple[Optional[str], Dict[int, dict]]:
   finger = gen_empty_fingerprint()
-  candidate_cars = {i: all_legacy_fingerprint_cars() for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1
+  # bitsets of candidate cars, attempt fingerprint on both bus 0 and 1
+  candidate_cars = {i: ALL_FINGERPRINT_CARS_MASK for i in [0, 1]}
   frame = 0
   car_fingerprint = None
   done = False
@@ -98,17 +122,17 @@ def can_fingerprint(next_can: Callable) -> Tuple[Optional[str], Dict[int, dict]]
       for b in candidate_cars:
         # Ignore extended messages and VIN query response.
         if can.src == b and can.address < 0x800 and can.address not in (0x7df, 0x7e0, 0x7e8):
-          candidate_cars[b] = eliminate_incompatible_cars(can, candidate_cars[b])
+          candidate_cars[b] &= compatible_cars_mask(can)
 
     # if we only have one car choice and the time since we got our first
     # message has elapsed, exit
     for b in candidate_cars:
-      if len(candidate_cars[b]) == 1 and frame > FRAME_FINGERPRINT:
+      if candidate_cars[b].bit_count() == 1 and frame > FRAME_FINGERPRINT:
         # fingerprint done
-        car_fingerprint = candidate_cars[b][0]
+        car_fingerprint = cars_from_mask(candidate_cars[b])[0]
 
     # bail if no cars left or we've been waiting for more than 2s
-    failed = (all(len(cc) == 0 for cc in candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
+    failed = (all(cc == 0 for cc in candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
     succeeded = car_fingerprint is not None
     done = failed or succeeded
 
@@ -12,6 +12,41 @@ def is_valid_for_fingerprint(msg, car_fingerprint: dict[int, int]):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+def _build_fingerprint_index(fingerprints: dict[str, list[dict[int, int]]]) -> tuple[list[str], dict[int, dict[int, int]], int]:
+  # every car gets a bit, and each (address, length) maps to the bitset of cars with a fingerprint containing it.
+  # also returns the bitset of cars with any fingerprint, which are compatible with every extended address
+  cars = list(fingerprints)
+  index: dict[int, dict[int, int]] = {}
+  extended = 0
+  for i, car_name in enumerate(cars):
+    for fingerprint in fingerprints[car_name]:
+      extended |= 1 << i
+      # add alien debug address
+      for adr, length in (fingerprint | _DEBUG_ADDRESS).items():
+        lengths = index.setdefault(adr, {})
+        lengths[length] = lengths.get(length, 0) | (1 << i)
+  return cars, index, extended
+
+
+_FINGERPRINT_CARS, _FINGERPRINT_INDEX, _EXTENDED_ADDRESS_MASK = _build_fingerprint_index(_FINGERPRINTS)
+_FINGERPRINT_CAR_BITS = {car_name: 1 << i for i, car_name in enumerate(_FINGERPRINT_CARS)}
+ALL_FINGERPRINT_CARS_MASK = (1 << len(_FINGERPRINT_CARS)) - 1
+
+
+def compatible_cars_mask(msg) -> int:
+  """Returns the bitset of legacy fingerprint cars that could have sent msg, see cars_from_mask."""
+  adr = msg.address
+  # ignore addresses that are more than 11 bits
+  if adr >= 0x800:
+    return _EXTENDED_ADDRESS_MASK
+  return _FINGERPRINT_INDEX.get(adr, {}).get(len(msg.dat), 0)
+
+
+def cars_from_mask(mask: int) -> list[str]:
+  """Returns the cars in a bitset of legacy fingerprint cars."""
+  return [car_name for i, car_name in enumerate(_FINGERPRINT_CARS) if mask >> i & 1]
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -22,18 +57,8 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      # add alien debug address
-      if is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  compatible = compatible_cars_mask(msg)
+  return [car_name for car_name in candidate_cars if _FINGERPRINT_CAR_BITS.get(car_name, 0) & compatible]
 
 
 def all_known_cars():
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from collections import defaultdict
-from typing import Any, DefaultDict, Dict, List, Optional, Set
+from functools import cache
+from typing import Any, DefaultDict, Dict, FrozenSet, List, Optional, Set, Tuple
 from tqdm import tqdm
 import capnp
 
@@ -55,20 +56,11 @@ def get_brand_addrs() -> Dict[str, Set[AddrType]]:
   return dict(brand_addrs)
 
 
-def match_fw_to_car_fuzzy(live_fw_versions, match_brand=None, log=True, exclude=None):
-  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
-  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
-  the match is rejected."""
-
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
+@cache
+def _get_fuzzy_fw_index() -> Dict[Tuple[int, Optional[int], bytes], List[str]]:
+  # Built once: lookup table from (addr, sub_addr, fw) to list of candidate cars of all brands
   all_fw_versions = defaultdict(list)
   for candidate, fw_by_addr in FW_VERSIONS.items():
-    if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
-      continue
-
-    if candidate == exclude:
-      continue
-
     for addr, fws in fw_by_addr.items():
       # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
       # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
@@ -78,6 +70,36 @@ def match_fw_to_car_fuzzy(live_fw_versions, match_brand=None, log=True, exclude=
         continue
       for f in fws:
         all_fw_versions[(addr[1], addr[2], f)].append(candidate)
+  return dict(all_fw_versions)
+
+
+@cache
+def _get_exact_fw_index() -> Dict[str, List[Tuple[str, List[Tuple[AddrType, FrozenSet[bytes], bool]]]]]:
+  # Built once: for each brand, its candidates and their ECUs to match as (addr, expected versions, optional)
+  exact_index: DefaultDict[str, List[Tuple[str, List[Tuple[AddrType, FrozenSet[bytes], bool]]]]] = defaultdict(list)
+  for candidate, fws in FW_VERSIONS.items():
+    brand = MODEL_TO_BRAND[candidate]
+    config = FW_QUERY_CONFIGS[brand]
+    ecus = []
+    for (ecu_type, addr, sub_addr), expected_versions in fws.items():
+      # Virtual debug ecu doesn't need to match the database
+      if ecu_type == Ecu.debug:
+        continue
+
+      # Some models can sometimes miss an ecu, or show on two different addresses.
+      # Non essential ecus can be missing as well
+      optional = candidate in config.non_essential_ecus.get(ecu_type, []) or ecu_type not in ESSENTIAL_ECUS
+      ecus.append(((addr, sub_addr), frozenset(expected_versions), optional))
+    exact_index[brand].append((candidate, ecus))
+  return dict(exact_index)
+
+
+def match_fw_to_car_fuzzy(live_fw_versions, match_brand=None, log=True, exclude=None):
+  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
+  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
+  the match is rejected."""
+
+  all_fw_versions = _get_fuzzy_fw_index()
 
   matched_ecus = set()
   candidate = None
@@ -85,7 +107,8 @@ def match_fw_to_car_fuzzy(live_fw_versions, match_brand=None, log=True, exclude=
     ecu_key = (addr[0], addr[1])
     for version in versions:
       # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(*ecu_key, version)]
+      candidates = [c for c in all_fw_versions.get((*ecu_key, version), [])
+                    if is_brand(MODEL_TO_BRAND[c], match_brand) and c != exclude]
 
       if len(candidates) == 1:
         matched_ecus.add(ecu_key)
@@ -110,35 +133,34 @@ def match_fw_to_car_exact(live_fw_versions, match_brand=None, log=True) -> Set[s
   FW versions for a list of "essential" ECUs. If an ECU is not considered
   essential the FW version can be missing to get a fingerprint, but if it's present it
   needs to match the database."""
-  invalid = set()
-  candidates = {c: f for c, f in FW_VERSIONS.items() if
-                is_brand(MODEL_TO_BRAND[c], match_brand)}
-
-  for candidate, fws in candidates.items():
-    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-    for ecu, expected_versions in fws.items():
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-
-      found_versions = live_fw_versions.get(addr, set())
-      if not len(found_versions):
-        # Some models can sometimes miss an ecu, or show on two different addresses
-        if candidate in config.non_essential_ecus.get(ecu_type, []):
-          continue
+  matches = set()
+  for brand, candidates in _get_exact_fw_index().items():
+    if not is_brand(brand, match_brand):
+      continue
 
-        # Ignore non essential ecus
-        if ecu_type not in ESSENTIAL_ECUS:
-          continue
+    for candidate, ecus in candidates:
+      for addr, expected_versions, optional in ecus:
+        found_versions = live_fw_versions.get(addr)
+        if not found_versions:
+          if optional:
+            continue
+          break
+        if expected_versions.isdisjoint(found_versions):
+          break
+      else:
+        matches.add(candidate)
 
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
-        continue
+  return matches
 
-      if not any(found_version in expected_versions for found_version in found_versions):
-        invalid.add(candidate)
-        break
 
-  return set(candidates.keys()) - invalid
+def build_fw_dicts(fw_versions: List[capnp.lib.capnp._DynamicStructBuilder]) -> Dict[str, Dict[AddrType, Set[bytes]]]:
+  """Same as build_fw_dict for every brand, in one pass over fw_versions"""
+  fw_versions_dicts: DefaultDict[str, DefaultDict[AddrType, Set[bytes]]] = defaultdict(lambda: defaultdict(set))
+  for fw in fw_versions:
+    if not fw.logging:
+      sub_addr = fw.subAddress if fw.subAddress != 0 else None
+      fw_versions_dicts[fw.brand][(fw.address, sub_addr)].add(fw.fwVersion)
+  return {brand: dict(fw_versions_dict) for brand, fw_versions_dict in fw_versions_dicts.items()}
 
 
 def match_fw_to_car(fw_versions, allow_exact=True, allow_fuzzy=True, log=True):
@@ -149,11 +171,12 @@ def match_fw_to_car(fw_versions, allow_exact=True, allow_fuzzy=True, log=True):
   if allow_fuzzy:
     exact_matches.append((False, match_fw_to_car_fuzzy))
 
+  fw_versions_dicts = build_fw_dicts(fw_versions)
   for exact_match, match_func in exact_matches:
     # For each brand, attempt to fingerprint using all FW returned from its queries
     matches = set()
     for brand in VERSIONS.keys():
-      fw_versions_dict = build_fw_dict(fw_versions, filter_brand=brand)
+      fw_versions_dict = fw_versions_dicts.get(brand, {})
       matches |= match_func(fw_versions_dict, match_brand=brand, log=log)
 
       # If specified and no matches so far, fall back to brand's fuzzy fingerprinting function
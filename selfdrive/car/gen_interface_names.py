@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+import json
+from typing import Dict, List
+
+from openpilot.selfdrive.car.car_helpers import INTERFACE_NAMES_JSON
+from openpilot.selfdrive.car.interfaces import get_interface_attr
+
+
+def get_interface_names() -> Dict[str, List[str]]:
+  # returns a dict of brand name and its respective models
+  brand_names = {}
+  for brand_name, brand_models in get_interface_attr("CAR").items():
+    brand_names[brand_name] = [model.value for model in brand_models]
+
+  return brand_names
+
+
+def generate_interface_names() -> str:
+  return json.dumps(get_interface_names(), indent=2) + "\n"
+
+
+if __name__ == "__main__":
+  with open(INTERFACE_NAMES_JSON, "w") as f:
+    f.write(generate_interface_names())
+  print(f"Generated and written to {INTERFACE_NAMES_JSON}")
@@ -4,6 +4,7 @@ import numpy as np
 import tomllib
 from abc import abstractmethod, ABC
 from enum import StrEnum
+from functools import cache
 from typing import Any, Dict, Optional, Tuple, List, Callable
 
 from cereal import car
@@ -32,16 +33,22 @@ TORQUE_OVERRIDE_PATH = os.path.join(BASEDIR, 'selfdrive/car/torque_data/override
 TORQUE_SUBSTITUTE_PATH = os.path.join(BASEDIR, 'selfdrive/car/torque_data/substitute.toml')
 
 
-def get_torque_params(candidate):
+@cache
+def get_torque_tables() -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+  # parsed once per process, treat as read-only
   with open(TORQUE_SUBSTITUTE_PATH, 'rb') as f:
     sub = tomllib.load(f)
-  if candidate in sub:
-    candidate = sub[candidate]
-
   with open(TORQUE_PARAMS_PATH, 'rb') as f:
     params = tomllib.load(f)
   with open(TORQUE_OVERRIDE_PATH, 'rb') as f:
     override = tomllib.load(f)
+  return sub, params, override
+
+
+def get_torque_params(candidate):
+  sub, params, override = get_torque_tables()
+  if candidate in sub:
+    candidate = sub[candidate]
 
   # Ensure no overlap
   if sum([candidate in x for x in [sub, params, override]]) > 1:
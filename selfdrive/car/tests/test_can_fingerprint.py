@@ -4,7 +4,8 @@ import unittest
 
 from cereal import log, messaging
 from openpilot.selfdrive.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint
-from openpilot.selfdrive.car.fingerprints import _FINGERPRINTS as FINGERPRINTS
+from openpilot.selfdrive.car.fingerprints import _DEBUG_ADDRESS, _FINGERPRINTS as FINGERPRINTS, all_legacy_fingerprint_cars, \
+                                                 eliminate_incompatible_cars, is_valid_for_fingerprint
 
 
 class TestCanFingerprint(unittest.TestCase):
@@ -26,6 +27,18 @@ class TestCanFingerprint(unittest.TestCase):
       self.assertEqual(finger[1], fingerprint)
       self.assertEqual(finger[2], {})
 
+  def test_fingerprint_index(self):
+    """Tests the precomputed fingerprint index against checking each fingerprint"""
+    addresses = {(address, length) for fingerprints in FINGERPRINTS.values() for fingerprint in fingerprints for address, length in fingerprint.items()}
+    addresses |= {(address, length + 1) for address, length in addresses} | {(0x800, 8), (0x7ff, 8), *_DEBUG_ADDRESS.items()}
+
+    all_cars = all_legacy_fingerprint_cars()
+    for address, length in addresses:
+      msg = log.CanData(address=address, dat=b'\x00' * length)
+      expected = [car_model for car_model in all_cars
+                  if any(is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS) for fingerprint in FINGERPRINTS[car_model])]
+      self.assertEqual(eliminate_incompatible_cars(msg, all_cars), expected, (address, length))
+
   def test_timing(self):
     # just pick any CAN fingerprinting car
     car_model = 'CHEVROLET BOLT EUV 2022'
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import os
 import math
+import tomllib
 import unittest
+from unittest import mock
 import hypothesis.strategies as st
 from hypothesis import Phase, given, settings
 import importlib
@@ -10,10 +12,11 @@ from parameterized import parameterized
 from cereal import car, messaging
 from openpilot.common.realtime import DT_CTRL
 from openpilot.selfdrive.car import gen_empty_fingerprint
-from openpilot.selfdrive.car.car_helpers import interfaces
+from openpilot.selfdrive.car.car_helpers import INTERFACE_NAMES_JSON, interfaces
 from openpilot.selfdrive.car.fingerprints import all_known_cars
 from openpilot.selfdrive.car.fw_versions import FW_VERSIONS
-from openpilot.selfdrive.car.interfaces import get_interface_attr
+from openpilot.selfdrive.car.gen_interface_names import generate_interface_names
+from openpilot.selfdrive.car.interfaces import get_interface_attr, get_torque_params, get_torque_tables
 from openpilot.selfdrive.test.fuzzy_generation import DrawType, FuzzyGenerator
 
 ALL_ECUS = list({ecu for ecus in FW_VERSIONS.values() for ecu in ecus.keys()})
@@ -147,6 +150,21 @@ class TestCarInterfaces(unittest.TestCase):
     none_brands_in_ret = none_brands.intersection(ret)
     self.assertEqual(len(none_brands_in_ret), 0, f'Brands with None values in ignore_none=True result: {none_brands_in_ret}')
 
+  def test_torque_params_parsed_once(self):
+    get_torque_tables.cache_clear()
+    with mock.patch("openpilot.selfdrive.car.interfaces.tomllib.load", wraps=tomllib.load) as load:
+      for torque_table in get_torque_tables():
+        for candidate in torque_table.keys() - {"legend"}:
+          get_torque_params(candidate)
+      self.assertEqual(load.call_count, 3)
+
+  def test_interface_names(self):
+    with open(INTERFACE_NAMES_JSON) as f:
+      current_interface_names = f.read()
+
+    self.assertEqual(generate_interface_names(), current_interface_names,
+                     "Run selfdrive/car/gen_interface_names.py to update the interface names")
+
 
 if __name__ == "__main__":
   unittest.main()
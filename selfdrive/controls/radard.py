@@ -2,14 +2,16 @@
 import importlib
 import math
 from collections import deque
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 import capnp
+import numpy as np
 from cereal import messaging, log, car
 from openpilot.common.numpy_fast import interp
 from openpilot.common.params import Params
 from openpilot.common.realtime import Ratekeeper, Priority, config_realtime_process
 from openpilot.common.swaglog import cloudlog
+from openpilot.selfdrive.car.interfaces import RadarInterfaceBase
 
 from openpilot.common.simple_kalman import KF1D
 
@@ -17,15 +19,15 @@ from openpilot.common.simple_kalman import KF1D
 # Default lead acceleration decay set to 50% at 1s
 _LEAD_ACCEL_TAU = 1.5
 
-# radar tracks
-SPEED, ACCEL = 0, 1     # Kalman filter states enum
-
 # stationary qualification parameters
 V_EGO_STATIONARY = 4.   # no stationary object flag below this speed
 
 RADAR_TO_CENTER = 2.7   # (deprecated) RADAR is ~ 2.7m ahead from center of car
 RADAR_TO_CAMERA = 1.52  # RADAR is ~ 1.5m ahead from center of mesh frame
 
+# below this many tracks, numpy's per call overhead costs more than updating and scoring the tracks one by one
+VECTORIZE_MIN_TRACKS = 32
+
 
 class KalmanParams:
   def __init__(self, dt: float):
@@ -49,75 +51,105 @@ class KalmanParams:
     self.K = [[interp(dt, dts, K0)], [interp(dt, dts, K1)]]
 
 
-class Track:
-  def __init__(self, identifier: int, v_lead: float, kalman_params: KalmanParams):
-    self.identifier = identifier
-    self.cnt = 0
-    self.aLeadTau = _LEAD_ACCEL_TAU
-    self.K_A = kalman_params.A
-    self.K_C = kalman_params.C
-    self.K_K = kalman_params.K
-    self.kf = KF1D([[v_lead], [0.0]], self.K_A, self.K_C, self.K_K)
-
-  def update(self, d_rel: float, y_rel: float, v_rel: float, v_lead: float, measured: float):
-    # relative values, copy
-    self.dRel = d_rel   # LONG_DIST
-    self.yRel = y_rel   # -LAT_DIST
-    self.vRel = v_rel   # REL_SPEED
-    self.vLead = v_lead
-    self.measured = measured   # measured or estimate
-
-    # computed velocity and accelerations
-    if self.cnt > 0:
-      self.kf.update(self.vLead)
-
-    self.vLeadK = float(self.kf.x[SPEED][0])
-    self.aLeadK = float(self.kf.x[ACCEL][0])
-
-    # Learn if constant acceleration
-    if abs(self.aLeadK) < 0.5:
-      self.aLeadTau = _LEAD_ACCEL_TAU
+class Tracks:
+  """
+  Radar tracks stored as columns, one row per track. Rows are kept in the order the tracks were created,
+  to break ties the same way as iterating over the tracks would.
+  The columns are lists, the Kalman update and the lead scoring only use numpy from VECTORIZE_MIN_TRACKS tracks on.
+  """
+  def __init__(self, kalman_params: KalmanParams):
+    # same constants as every track's KF1D
+    kf = KF1D([[0.0], [0.0]], kalman_params.A, kalman_params.C, kalman_params.K)
+    self.A_K = (kf.A_K_0, kf.A_K_1, kf.A_K_2, kf.A_K_3)
+    self.K = (kf.K0_0, kf.K1_0)
+
+    self.identifier: List[int] = []
+    self.dRel: List[float] = []  # LONG_DIST
+    self.yRel: List[float] = []  # -LAT_DIST
+    self.vRel: List[float] = []  # REL_SPEED
+    self.vLead: List[float] = []
+    self.measured: List[bool] = []  # measured or estimate
+    self.vLeadK: List[float] = []  # Kalman filter SPEED state
+    self.aLeadK: List[float] = []  # Kalman filter ACCEL state
+    self.aLeadTau: List[float] = []
+
+  def __len__(self) -> int:
+    return len(self.identifier)
+
+  def update(self, ar_pts: Dict[int, List[float]], v_ego: float):
+    # *** remove missing points from meta data ***
+    keep = [i for i, ids in enumerate(self.identifier) if ids in ar_pts]
+    if len(keep) < len(self):
+      self.identifier = [self.identifier[i] for i in keep]
+      self.vLeadK = [self.vLeadK[i] for i in keep]
+      self.aLeadK = [self.aLeadK[i] for i in keep]
+      self.aLeadTau = [self.aLeadTau[i] for i in keep]
+
+    # *** create the tracks that don't exist, in the order of the points ***
+    n_upd = len(self)
+    existing = set(self.identifier)
+    for ids, rpt in ar_pts.items():
+      if ids not in existing:
+        # align v_ego by a fixed time to align it with the radar measurement
+        self.identifier.append(ids)
+        self.vLeadK.append(rpt[2] + v_ego)
+        self.aLeadK.append(0.0)
+        self.aLeadTau.append(_LEAD_ACCEL_TAU)
+
+    # relative values of each track's point
+    pts = [ar_pts[ids] for ids in self.identifier]
+    self.dRel = [pt[0] for pt in pts]
+    self.yRel = [pt[1] for pt in pts]
+    self.vRel = [pt[2] for pt in pts]
+    self.vLead = [pt[2] + v_ego for pt in pts]
+    self.measured = [bool(pt[3]) for pt in pts]
+
+    # computed velocity and accelerations, the new tracks at the end start from their first point
+    A_K_0, A_K_1, A_K_2, A_K_3 = self.A_K
+    K0, K1 = self.K
+    if n_upd < VECTORIZE_MIN_TRACKS:
+      for i in range(n_upd):
+        x0, x1, meas = self.vLeadK[i], self.aLeadK[i], self.vLead[i]
+        self.vLeadK[i] = A_K_0 * x0 + A_K_1 * x1 + K0 * meas
+        self.aLeadK[i] = A_K_2 * x0 + A_K_3 * x1 + K1 * meas
     else:
-      self.aLeadTau *= 0.9
-
-    self.cnt += 1
+      x0, x1, meas = np.array(self.vLeadK[:n_upd]), np.array(self.aLeadK[:n_upd]), np.array(self.vLead[:n_upd])
+      self.vLeadK[:n_upd] = (A_K_0 * x0 + A_K_1 * x1 + K0 * meas).tolist()
+      self.aLeadK[:n_upd] = (A_K_2 * x0 + A_K_3 * x1 + K1 * meas).tolist()
 
-  def get_key_for_cluster(self):
-    # Weigh y higher since radar is inaccurate in this dimension
-    return [self.dRel, self.yRel*2, self.vRel]
-
-  def reset_a_lead(self, aLeadK: float, aLeadTau: float):
-    self.kf = KF1D([[self.vLead], [aLeadK]], self.K_A, self.K_C, self.K_K)
-    self.aLeadK = aLeadK
-    self.aLeadTau = aLeadTau
+    # Learn if constant acceleration
+    self.aLeadTau = [_LEAD_ACCEL_TAU if abs(a_lead) < 0.5 else tau * 0.9 for a_lead, tau in zip(self.aLeadK, self.aLeadTau, strict=True)]
 
-  def get_RadarState(self, model_prob: float = 0.0):
+  def get_RadarState(self, idx: int, model_prob: float = 0.0):
     return {
-      "dRel": float(self.dRel),
-      "yRel": float(self.yRel),
-      "vRel": float(self.vRel),
-      "vLead": float(self.vLead),
-      "vLeadK": float(self.vLeadK),
-      "aLeadK": float(self.aLeadK),
-      "aLeadTau": float(self.aLeadTau),
+      "dRel": float(self.dRel[idx]),
+      "yRel": float(self.yRel[idx]),
+      "vRel": float(self.vRel[idx]),
+      "vLead": float(self.vLead[idx]),
+      "vLeadK": float(self.vLeadK[idx]),
+      "aLeadK": float(self.aLeadK[idx]),
+      "aLeadTau": float(self.aLeadTau[idx]),
       "status": True,
-      "fcw": self.is_potential_fcw(model_prob),
+      "fcw": is_potential_fcw(model_prob),
       "modelProb": model_prob,
       "radar": True,
-      "radarTrackId": self.identifier,
+      "radarTrackId": self.identifier[idx],
     }
 
-  def potential_low_speed_lead(self, v_ego: float):
+  def potential_low_speed_leads(self, v_ego: float) -> List[int]:
     # stop for stuff in front of you and low speed, even without model confirmation
     # Radar points closer than 0.75, are almost always glitches on toyota radars
-    return abs(self.yRel) < 1.0 and (v_ego < V_EGO_STATIONARY) and (0.75 < self.dRel < 25)
-
-  def is_potential_fcw(self, model_prob: float):
-    return model_prob > .9
+    if not v_ego < V_EGO_STATIONARY:
+      return []
+    return [i for i, (d_rel, y_rel) in enumerate(zip(self.dRel, self.yRel, strict=True)) if abs(y_rel) < 1.0 and 0.75 < d_rel < 25]
 
   def __str__(self):
-    ret = f"x: {self.dRel:4.1f}  y: {self.yRel:4.1f}  v: {self.vRel:4.1f}  a: {self.aLeadK:4.1f}"
-    return ret
+    return "\n".join(f"x: {d:4.1f}  y: {y:4.1f}  v: {v:4.1f}  a: {a:4.1f}"
+                     for d, y, v, a in zip(self.dRel, self.yRel, self.vRel, self.aLeadK, strict=True))
+
+
+def is_potential_fcw(model_prob: float):
+  return model_prob > .9
 
 
 def laplacian_pdf(x: float, mu: float, b: float):
@@ -125,25 +157,44 @@ def laplacian_pdf(x: float, mu: float, b: float):
   return math.exp(-abs(x-mu)/b)
 
 
-def match_vision_to_track(v_ego: float, lead: capnp._DynamicStructReader, tracks: Dict[int, Track]):
+def laplacian_exponent(x: np.ndarray, mu: float, b: float) -> np.ndarray:
+  b = max(b, 1e-4)
+  return -np.abs(x-mu)/b
+
+
+def match_vision_to_track(v_ego: float, lead: capnp._DynamicStructReader, tracks: Tracks) -> Optional[int]:
   offset_vision_dist = lead.x[0] - RADAR_TO_CAMERA
 
-  def prob(c):
-    prob_d = laplacian_pdf(c.dRel, offset_vision_dist, lead.xStd[0])
-    prob_y = laplacian_pdf(c.yRel, -lead.y[0], lead.yStd[0])
-    prob_v = laplacian_pdf(c.vRel + v_ego, lead.v[0], lead.vStd[0])
+  def prob(idx):
+    prob_d = laplacian_pdf(tracks.dRel[idx], offset_vision_dist, lead.xStd[0])
+    prob_y = laplacian_pdf(tracks.yRel[idx], -lead.y[0], lead.yStd[0])
+    prob_v = laplacian_pdf(tracks.vRel[idx] + v_ego, lead.v[0], lead.vStd[0])
 
     # This is isn't exactly right, but good heuristic
     return prob_d * prob_y * prob_v
 
-  track = max(tracks.values(), key=prob)
+  if len(tracks) < VECTORIZE_MIN_TRACKS:
+    idx = max(range(len(tracks)), key=prob)
+  else:
+    # same as the product of the three laplacian_pdfs, within 1e-12 while it doesn't underflow
+    probs = np.exp(laplacian_exponent(np.array(tracks.dRel), offset_vision_dist, lead.xStd[0]) +
+                   laplacian_exponent(np.array(tracks.yRel), -lead.y[0], lead.yStd[0]) +
+                   laplacian_exponent(np.array(tracks.vRel) + v_ego, lead.v[0], lead.vStd[0]))
+    # pick the most likely track with prob like before, from the tracks that are about as likely as the best one
+    max_prob = probs.max()
+    if max_prob > 1e-290:
+      candidates = np.flatnonzero(probs >= max_prob * (1 - 1e-9)).tolist()
+    else:
+      candidates = list(range(len(tracks)))
+    idx = candidates[0] if len(candidates) == 1 else max(candidates, key=prob)
 
   # if no 'sane' match is found return -1
   # stationary radar points can be false positives
-  dist_sane = abs(track.dRel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
-  vel_sane = (abs(track.vRel + v_ego - lead.v[0]) < 10) or (v_ego + track.vRel > 3)
+  d_rel, v_rel = tracks.dRel[idx], tracks.vRel[idx]
+  dist_sane = abs(d_rel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
+  vel_sane = (abs(v_rel + v_ego - lead.v[0]) < 10) or (v_ego + v_rel > 3)
   if dist_sane and vel_sane:
-    return track
+    return idx
   else:
     return None
 
@@ -166,7 +217,7 @@ def get_RadarState_from_vision(lead_msg: capnp._DynamicStructReader, v_ego: floa
   }
 
 
-def get_lead(v_ego: float, ready: bool, tracks: Dict[int, Track], lead_msg: capnp._DynamicStructReader,
+def get_lead(v_ego: float, ready: bool, tracks: Tracks, lead_msg: capnp._DynamicStructReader,
              model_v_ego: float, low_speed_override: bool = True) -> Dict[str, Any]:
   # Determine leads, this is where the essential logic happens
   if len(tracks) > 0 and ready and lead_msg.prob > .5:
@@ -176,18 +227,18 @@ def get_lead(v_ego: float, ready: bool, tracks: Dict[int, Track], lead_msg: capn
 
   lead_dict = {'status': False}
   if track is not None:
-    lead_dict = track.get_RadarState(lead_msg.prob)
+    lead_dict = tracks.get_RadarState(track, lead_msg.prob)
   elif (track is None) and ready and (lead_msg.prob > .5):
     lead_dict = get_RadarState_from_vision(lead_msg, v_ego, model_v_ego)
 
   if low_speed_override:
-    low_speed_tracks = [c for c in tracks.values() if c.potential_low_speed_lead(v_ego)]
+    low_speed_tracks = tracks.potential_low_speed_leads(v_ego)
     if len(low_speed_tracks) > 0:
-      closest_track = min(low_speed_tracks, key=lambda c: c.dRel)
+      closest_track = min(low_speed_tracks, key=lambda idx: tracks.dRel[idx])
 
       # Only choose new track if it is actually closer than the previous one
-      if (not lead_dict['status']) or (closest_track.dRel < lead_dict['dRel']):
-        lead_dict = closest_track.get_RadarState()
+      if (not lead_dict['status']) or (tracks.dRel[closest_track] < lead_dict['dRel']):
+        lead_dict = tracks.get_RadarState(closest_track)
 
   return lead_dict
 
@@ -196,8 +247,8 @@ class RadarD:
   def __init__(self, radar_ts: float, delay: int = 0):
     self.current_time = 0.0
 
-    self.tracks: Dict[int, Track] = {}
     self.kalman_params = KalmanParams(radar_ts)
+    self.tracks = Tracks(self.kalman_params)
 
     self.v_ego = 0.0
     self.v_ego_hist = deque([0.0], maxlen=delay+1)
@@ -226,22 +277,8 @@ class RadarD:
     for pt in radar_points:
       ar_pts[pt.trackId] = [pt.dRel, pt.yRel, pt.vRel, pt.measured]
 
-    # *** remove missing points from meta data ***
-    for ids in list(self.tracks.keys()):
-      if ids not in ar_pts:
-        self.tracks.pop(ids, None)
-
     # *** compute the tracks ***
-    for ids in ar_pts:
-      rpt = ar_pts[ids]
-
-      # align v_ego by a fixed time to align it with the radar measurement
-      v_lead = rpt[2] + self.v_ego_hist[0]
-
-      # create the track if it doesn't exist or it's a new track
-      if ids not in self.tracks:
-        self.tracks[ids] = Track(ids, v_lead, self.kalman_params)
-      self.tracks[ids].update(rpt[0], rpt[1], rpt[2], v_lead, rpt[3])
+    self.tracks.update(ar_pts, self.v_ego_hist[0])
 
     # *** publish radarState ***
     self.radar_state_valid = sm.all_checks() and len(radar_errors) == 0
@@ -271,16 +308,32 @@ class RadarD:
     # publish tracks for UI debugging (keep last)
     tracks_msg = messaging.new_message('liveTracks', len(self.tracks))
     tracks_msg.valid = self.radar_state_valid
-    for index, tid in enumerate(sorted(self.tracks.keys())):
+    for index, idx in enumerate(sorted(range(len(self.tracks)), key=self.tracks.identifier.__getitem__)):
       tracks_msg.liveTracks[index] = {
-        "trackId": tid,
-        "dRel": float(self.tracks[tid].dRel),
-        "yRel": float(self.tracks[tid].yRel),
-        "vRel": float(self.tracks[tid].vRel),
+        "trackId": int(self.tracks.identifier[idx]),
+        "dRel": float(self.tracks.dRel[idx]),
+        "yRel": float(self.tracks.yRel[idx]),
+        "vRel": float(self.tracks.vRel[idx]),
       }
     pm.send('liveTracks', tracks_msg)
 
 
+def step(sm: messaging.SubMaster, pm: messaging.PubMaster, RI: RadarInterfaceBase, RD: RadarD, rk: Ratekeeper,
+         can_strings: List[bytes]) -> Optional[car.RadarData]:
+  rr = RI.update(can_strings)
+  if rr is None:
+    return None
+
+  # the SubMaster is only updated once the radar interface returns data
+  sm.update(0)
+
+  RD.update(sm, rr)
+  RD.publish(pm, -rk.remaining*1000.0)
+
+  rk.monitor_time()
+  return rr
+
+
 # fuses camera and radar data for best lead detection
 def radard_thread(sm: Optional[messaging.SubMaster] = None, pm: Optional[messaging.PubMaster] = None, can_sock: Optional[messaging.SubSocket] = None):
   config_realtime_process(5, Priority.CTRL_LOW)
@@ -310,17 +363,7 @@ def radard_thread(sm: Optional[messaging.SubMaster] = None, pm: Optional[messagi
 
   while 1:
     can_strings = messaging.drain_sock_raw(can_sock, wait_for_one=True)
-    rr = RI.update(can_strings)
-
-    if rr is None:
-      continue
-
-    sm.update(0)
-
-    RD.update(sm, rr)
-    RD.publish(pm, -rk.remaining*1000.0)
-
-    rk.monitor_time()
+    step(sm, pm, RI, RD, rk, can_strings)
 
 
 def main(sm: Optional[messaging.SubMaster] = None, pm: Optional[messaging.PubMaster] = None, can_sock: messaging.SubSocket = None):
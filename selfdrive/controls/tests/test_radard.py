@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from parameterized import parameterized
+
+from openpilot.common.simple_kalman import KF1D
+from openpilot.selfdrive.controls.radard import _LEAD_ACCEL_TAU, VECTORIZE_MIN_TRACKS, KalmanParams, Tracks
+
+
+def generate_frames(n_points, n_frames=100, seed=0):
+  # fixed radar points, replacing a track now and then so tracks appear and disappear
+  rnd = random.Random(seed)
+  ids = list(range(n_points))
+  next_id = n_points
+  frames = []
+  for _ in range(n_frames):
+    if rnd.random() < 0.2:
+      ids[rnd.randrange(n_points)] = next_id
+      next_id += 1
+    frames.append({ids: [rnd.uniform(1., 80.), rnd.uniform(-5., 5.), rnd.uniform(-10., 5.), rnd.random() < 0.8] for ids in ids})
+  return frames
+
+
+class TestTracks(unittest.TestCase):
+  @parameterized.expand([(VECTORIZE_MIN_TRACKS // 4,), (VECTORIZE_MIN_TRACKS * 2,)])
+  def test_same_as_kf1d_per_track(self, n_points):
+    # each track should be filtered like it had its own KF1D, like the per-track radard did
+    kalman_params = KalmanParams(0.05)
+    tracks = Tracks(kalman_params)
+    kfs, a_lead_taus = {}, {}
+    v_ego = 15.
+
+    for ar_pts in generate_frames(n_points):
+      tracks.update(ar_pts, v_ego)
+
+      kfs = {ids: kf for ids, kf in kfs.items() if ids in ar_pts}
+      a_lead_taus = {ids: tau for ids, tau in a_lead_taus.items() if ids in ar_pts}
+      for ids, (_, _, v_rel, _) in ar_pts.items():
+        if ids in kfs:
+          kfs[ids].update(v_rel + v_ego)
+        else:
+          kfs[ids] = KF1D([[v_rel + v_ego], [0.0]], kalman_params.A, kalman_params.C, kalman_params.K)
+          a_lead_taus[ids] = _LEAD_ACCEL_TAU
+        a_lead_taus[ids] = _LEAD_ACCEL_TAU if abs(kfs[ids].x[1][0]) < 0.5 else a_lead_taus[ids] * 0.9
+
+      self.assertEqual(sorted(tracks.identifier), sorted(ar_pts))
+      for idx, ids in enumerate(tracks.identifier):
+        self.assertEqual([tracks.dRel[idx], tracks.yRel[idx], tracks.vRel[idx], tracks.measured[idx]], ar_pts[ids])
+        self.assertEqual(tracks.vLeadK[idx], kfs[ids].x[0][0])
+        self.assertEqual(tracks.aLeadK[idx], kfs[ids].x[1][0])
+        self.assertEqual(tracks.aLeadTau[idx], a_lead_taus[ids])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+import subprocess
+import sys
+import numpy as np
+
+N_RUNS = 5
+
+# car_helpers imports car interfaces lazily, load_interfaces imports every brand like it did on import before
+LAZY = "import openpilot.selfdrive.car.car_helpers"
+EAGER = LAZY + "; from openpilot.selfdrive.car.car_helpers import interface_names, load_interfaces; load_interfaces(interface_names)"
+TIMED = "import time; t = time.perf_counter(); {}; print(time.perf_counter() - t)"
+
+
+def import_time(stmt: str) -> float:
+  # each run needs a fresh interpreter, so no modules are already imported
+  out = subprocess.check_output([sys.executable, "-c", TIMED.format(stmt)], encoding="utf8")
+  return float(out.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+  for name, stmt in (("eager (before)", EAGER), ("lazy (after)", LAZY)):
+    ets = [import_time(stmt) * 1e3 for _ in range(N_RUNS)]
+    print(f'{name}: {np.mean(ets):.2f} mean ms, {max(ets):.2f} max ms, {min(ets):.2f} min ms, {np.std(ets):.2f} std ms')
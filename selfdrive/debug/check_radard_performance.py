@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import argparse
+import importlib
+import time
+import numpy as np
+
+from openpilot.common.realtime import Ratekeeper
+from openpilot.selfdrive.controls import radard
+from openpilot.selfdrive.test.process_replay.in_process import ReplayPubMaster, ReplaySubMaster
+from openpilot.selfdrive.test.process_replay.test_processes import source_segments
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.openpilotci import get_url
+
+# cars with radars that report many points
+RADAR_HEAVY_SEGMENTS = ["TOYOTA2", "GM", "CHRYSLER", "FORD"]
+
+
+def replay_radard(lr):
+  CP = next(m.carParams for m in lr if m.which() == 'carParams')
+  RadarInterface = importlib.import_module(f'openpilot.selfdrive.car.{CP.carName}.radar_interface').RadarInterface
+  RI = RadarInterface(CP)
+  RD = radard.RadarD(CP.radarTimeStep, RI.delay)
+  rk = Ratekeeper(1.0 / CP.radarTimeStep, print_delay_threshold=None)
+  sm = ReplaySubMaster(['modelV2', 'carState'], ignore_avg_freq=['modelV2', 'carState'])
+  pm = ReplayPubMaster(['radarState', 'liveTracks'])
+
+  ets, n_points = [], []
+  for msg in lr:
+    sm.queue([msg])
+    if msg.which() != 'can':
+      continue
+
+    start_t = time.process_time_ns()
+    rr = radard.step(sm, pm, RI, RD, rk, [msg.as_builder().to_bytes()])
+    if rr is not None:
+      ets.append((time.process_time_ns() - start_t) * 1e-3)
+      n_points.append(len(rr.points))
+      pm.drain('radarState')
+      pm.drain('liveTracks')
+  return ets, n_points
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Time radard.step on process replay segments",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--segments", nargs="+", default=RADAR_HEAVY_SEGMENTS, help="Process replay source segments to replay")
+  args = parser.parse_args()
+
+  for name, segment in source_segments:
+    if name not in args.segments:
+      continue
+
+    lr = list(LogReader(get_url(*segment.rsplit("--", 1))))
+    ets, n_points = replay_radard(lr)
+    print(f'{name}: {len(ets)} radar frames, {np.mean(n_points):.1f} mean points, {max(n_points)} max points')
+    print(f'  {np.mean(ets):.2f} mean us, {max(ets):.2f} max us, {np.std(ets):.2f} std us')
@@ -214,6 +214,23 @@ class TorqueEstimator(ParameterEstimator):
     return msg
 
 
+def step(sm, pm, params, estimator):
+  if sm.all_checks():
+    for which in sm.updated.keys():
+      if sm.updated[which]:
+        t = sm.logMonoTime[which] * 1e-9
+        estimator.handle_log(t, which, sm[which])
+
+  # 4Hz driven by liveLocationKalman
+  if sm.frame % 5 == 0:
+    pm.send('liveTorqueParameters', estimator.get_msg(valid=sm.all_checks()))
+
+  # Cache points every 60 seconds while onroad
+  if sm.frame % 240 == 0:
+    msg = estimator.get_msg(valid=sm.all_checks(), with_points=True)
+    params.put_nonblocking("LiveTorqueParameters", msg.to_bytes())
+
+
 def main():
   config_realtime_process([0, 1, 2, 3], 5)
 
@@ -226,20 +243,7 @@ def main():
 
   while True:
     sm.update()
-    if sm.all_checks():
-      for which in sm.updated.keys():
-        if sm.updated[which]:
-          t = sm.logMonoTime[which] * 1e-9
-          estimator.handle_log(t, which, sm[which])
-
-    # 4Hz driven by liveLocationKalman
-    if sm.frame % 5 == 0:
-      pm.send('liveTorqueParameters', estimator.get_msg(valid=sm.all_checks()))
-
-    # Cache points every 60 seconds while onroad
-    if sm.frame % 240 == 0:
-      msg = estimator.get_msg(valid=sm.all_checks(), with_points=True)
-      params.put_nonblocking("LiveTorqueParameters", msg.to_bytes())
+    step(sm, pm, params, estimator)
 
 if __name__ == "__main__":
   main()
@@ -4,22 +4,19 @@ import math
 import capnp
 import numbers
 import dictdiffer
-from collections import Counter
-from typing import Dict
+import numpy as np
+from collections import Counter, defaultdict
+from typing import DefaultDict, Dict, List, Optional, Tuple
 
 from openpilot.tools.lib.logreader import LogReader
 
 EPSILON = sys.float_info.epsilon
 
 
-def remove_ignored_fields(msg, ignore):
+def _remove_ignored_fields(msg, ignore_keys):
   msg = msg.as_builder()
-  for key in ignore:
+  for keys in ignore_keys:
     attr = msg
-    keys = key.split(".")
-    if msg.which() != keys[0] and len(keys) > 1:
-      continue
-
     for k in keys[:-1]:
       # indexing into list
       if k.isdigit():
@@ -40,6 +37,60 @@ def remove_ignored_fields(msg, ignore):
   return msg
 
 
+class IgnoredFields:
+  """Ignored fields split into keys once, and grouped by the services they apply to"""
+  def __init__(self, ignore):
+    self.keys = [key.split(".") for key in ignore]
+    self.by_service: Dict[str, List[List[str]]] = {}
+
+  def __getitem__(self, service):
+    if service not in self.by_service:
+      self.by_service[service] = [keys for keys in self.keys if len(keys) == 1 or keys[0] == service]
+    return self.by_service[service]
+
+
+def remove_ignored_fields(msg, ignore):
+  return _remove_ignored_fields(msg, IgnoredFields(ignore)[msg.which()])
+
+
+def _flatten(obj, path, out):
+  if isinstance(obj, dict) and len(obj):
+    for k, v in obj.items():
+      _flatten(v, path + (k,), out)
+  elif isinstance(obj, list) and len(obj):
+    for i, v in enumerate(obj):
+      _flatten(v, path + (i,), out)
+  else:
+    out.append((path, obj))
+  return out
+
+
+def _diff_dicts(msg1_dict, msg2_dict, ignore_fields, tolerance):
+  dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields)
+
+  # Dictdiffer only supports relative tolerance, we also want to check for absolute
+  # TODO: add this to dictdiffer
+  def outside_tolerance(diff):
+    try:
+      if diff[0] == "change":
+        a, b = diff[2]
+        finite = math.isfinite(a) and math.isfinite(b)
+        if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
+          return abs(a - b) > max(tolerance, tolerance * max(abs(a), abs(b)))
+    except TypeError:
+      pass
+    return True
+
+  return list(filter(outside_tolerance, dd))
+
+
+def _within_tolerance(a, b, tolerance):
+  # same check as outside_tolerance in _diff_msg, for all changed floats of a service at once
+  with np.errstate(invalid='ignore', over='ignore'):
+    finite = np.isfinite(a) & np.isfinite(b)
+    return finite & (np.abs(a - b) <= np.maximum(tolerance, tolerance * np.maximum(np.abs(a), np.abs(b))))
+
+
 def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None,):
   if ignore_fields is None:
     ignore_fields = []
@@ -57,36 +108,58 @@ def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=Non
     cnt2 = Counter(m.which() for m in log2)
     raise Exception(f"logs are not same length: {len(log1)} VS {len(log2)}\n\t\t{cnt1}\n\t\t{cnt2}")
 
-  diff = []
+  ignored = IgnoredFields(ignore_fields)
+  changed = []
   for msg1, msg2 in zip(log1, log2, strict=True):
     if msg1.which() != msg2.which():
       raise Exception("msgs not aligned between logs")
 
-    msg1 = remove_ignored_fields(msg1, ignore_fields)
-    msg2 = remove_ignored_fields(msg2, ignore_fields)
+    ignore_keys = ignored[msg1.which()]
+    msg1 = _remove_ignored_fields(msg1, ignore_keys)
+    msg2 = _remove_ignored_fields(msg2, ignore_keys)
 
     if msg1.to_bytes() != msg2.to_bytes():
-      msg1_dict = msg1.as_reader().to_dict(verbose=True)
-      msg2_dict = msg2.as_reader().to_dict(verbose=True)
-
-      dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields)
-
-      # Dictdiffer only supports relative tolerance, we also want to check for absolute
-      # TODO: add this to dictdiffer
-      def outside_tolerance(diff):
-        try:
-          if diff[0] == "change":
-            a, b = diff[2]
-            finite = math.isfinite(a) and math.isfinite(b)
-            if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
-              return abs(a - b) > max(tolerance, tolerance * max(abs(a), abs(b)))
-        except TypeError:
-          pass
-        return True
-
-      dd = list(filter(outside_tolerance, dd))
-
-      diff.extend(dd)
+      changed.append((msg1, msg2))
+
+  # Messages that only differ by floats within tolerance have no diff. Find them by comparing the changed
+  # floats of each service as arrays, only the other messages go through dictdiffer to get their diffs.
+  # has_diff keeps the dicts of messages with a diff
+  has_diff: List[Optional[Tuple[dict, dict]]] = [None] * len(changed)
+  floats: DefaultDict[str, Tuple[List[int], List[float], List[float]]] = defaultdict(lambda: ([], [], []))
+  for i, (msg1, msg2) in enumerate(changed):
+    msg1_dict = msg1.as_reader().to_dict(verbose=True)
+    msg2_dict = msg2.as_reader().to_dict(verbose=True)
+    leaves1 = _flatten(msg1_dict, (), [])
+    leaves2 = _flatten(msg2_dict, (), [])
+    if len(leaves1) != len(leaves2):
+      has_diff[i] = (msg1_dict, msg2_dict)
+      continue
+
+    idxs, a, b = floats[msg1.which()]
+    for (path1, v1), (path2, v2) in zip(leaves1, leaves2, strict=True):
+      if path1 != path2:
+        has_diff[i] = (msg1_dict, msg2_dict)
+        break
+      elif v1 != v2:
+        if isinstance(v1, float) and isinstance(v2, float):
+          idxs.append(i)
+          a.append(v1)
+          b.append(v2)
+        else:
+          has_diff[i] = (msg1_dict, msg2_dict)
+          break
+
+  for idxs, a, b in floats.values():
+    outside = ~_within_tolerance(np.array(a, dtype=np.float64), np.array(b, dtype=np.float64), tolerance)
+    for i in np.array(idxs, dtype=np.int64)[outside]:
+      if has_diff[i] is None:
+        msg1, msg2 = changed[i]
+        has_diff[i] = (msg1.as_reader().to_dict(verbose=True), msg2.as_reader().to_dict(verbose=True))
+
+  diff = []
+  for dicts in has_diff:
+    if dicts is not None:
+      diff.extend(_diff_dicts(*dicts, ignore_fields, tolerance))
   return diff
 
 
@@ -0,0 +1,115 @@
+import functools
+import importlib
+import time
+from typing import Dict, List
+
+import capnp
+
+import cereal.messaging as messaging
+from cereal import car
+from openpilot.common.params import Params
+from openpilot.common.realtime import Ratekeeper
+
+
+class ReplayPubSocket:
+  def __init__(self):
+    self.data: List[bytes] = []
+
+  def send(self, data: bytes):
+    self.data.append(data)
+
+  def all_readers_updated(self) -> bool:
+    return True
+
+
+class ReplayPubMaster(messaging.PubMaster):
+  """PubMaster which keeps the sent messages, to be drained by the replay instead of subscribers"""
+  def __init__(self, services: List[str]):
+    self.sock = {s: ReplayPubSocket() for s in services}
+
+  def drain(self, service: str) -> List[capnp._DynamicStructReader]:
+    sock = self.sock[service]
+    msgs, sock.data = sock.data, []
+    return [messaging.log_from_bytes(dat) for dat in msgs]
+
+
+class ReplaySubMaster(messaging.SubMaster):
+  """SubMaster which receives the messages queued by the replay instead of reading its sockets"""
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.queued: List[capnp._DynamicStructReader] = []
+
+  def queue(self, msgs: List[capnp._DynamicStructReader]):
+    self.queued.extend(m for m in msgs if m.which() in self.data)
+
+  def update(self, timeout: int = 100):
+    # SubMaster sockets are conflated, only the latest message of each service is received
+    latest = {m.which(): m for m in self.queued}
+    self.queued = []
+    self.update_msgs(time.monotonic(), list(latest.values()))
+
+
+class InProcessRunner:
+  """
+  Drives a daemon's step function directly with the messages of one receive cycle.
+  The SubMaster must be created with the same arguments as the daemon's main.
+  The daemons are imported by the runners, so that the replay doesn't import them unless they're run in-process.
+  """
+  def __init__(self, pm: ReplayPubMaster, sm: ReplaySubMaster):
+    self.pm = pm
+    self.sm = sm
+
+  def step(self, msgs: List[capnp._DynamicStructReader]):
+    raise NotImplementedError
+
+
+class RadardRunner(InProcessRunner):
+  def __init__(self, pm: ReplayPubMaster):
+    from openpilot.selfdrive.controls import radard
+    super().__init__(pm, ReplaySubMaster(['modelV2', 'carState'], ignore_avg_freq=['modelV2', 'carState']))
+
+    with car.CarParams.from_bytes(Params().get("CarParams", block=True)) as msg:
+      CP = msg
+    RadarInterface = importlib.import_module(f'openpilot.selfdrive.car.{CP.carName}.radar_interface').RadarInterface
+    RI = RadarInterface(CP)
+    RD = radard.RadarD(CP.radarTimeStep, RI.delay)
+    rk = Ratekeeper(1.0 / CP.radarTimeStep, print_delay_threshold=None)
+    self.radard_step = functools.partial(radard.step, self.sm, self.pm, RI, RD, rk)
+
+  def step(self, msgs):
+    # radard only updates its SubMaster once the radar interface returns data, until then the messages stay queued
+    self.sm.queue(msgs)
+    self.radard_step([m.as_builder().to_bytes() for m in msgs if m.which() == 'can'])
+
+
+class CalibrationdRunner(InProcessRunner):
+  def __init__(self, pm: ReplayPubMaster):
+    from openpilot.selfdrive.locationd import calibrationd
+    super().__init__(pm, ReplaySubMaster(['cameraOdometry', 'carState', 'carParams'], poll=['cameraOdometry']))
+    self.calibrationd_step = functools.partial(calibrationd.step, self.sm, self.pm, calibrationd.Calibrator(param_put=True))
+
+  def step(self, msgs):
+    self.sm.queue(msgs)
+    self.sm.update(0)
+    self.calibrationd_step()
+
+
+class TorquedRunner(InProcessRunner):
+  def __init__(self, pm: ReplayPubMaster):
+    from openpilot.selfdrive.locationd import torqued
+    super().__init__(pm, ReplaySubMaster(['carControl', 'carState', 'liveLocationKalman'], poll=['liveLocationKalman']))
+    params = Params()
+    with car.CarParams.from_bytes(params.get("CarParams", block=True)) as CP:
+      self.torqued_step = functools.partial(torqued.step, self.sm, self.pm, params, torqued.TorqueEstimator(CP))
+
+  def step(self, msgs):
+    self.sm.queue(msgs)
+    self.sm.update(0)
+    self.torqued_step()
+
+
+IN_PROCESS_RUNNERS: Dict[str, type] = {
+  "radard": RadardRunner,
+  "calibrationd": CalibrationdRunner,
+  "torqued": TorquedRunner,
+}
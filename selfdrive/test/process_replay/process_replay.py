@@ -26,6 +26,7 @@ from openpilot.selfdrive.manager.process_config import managed_processes
 from openpilot.selfdrive.test.process_replay.vision_meta import meta_from_camera_state, available_streams
 from openpilot.selfdrive.test.process_replay.migration import migrate_all
 from openpilot.selfdrive.test.process_replay.capture import ProcessOutputCapture
+from openpilot.selfdrive.test.process_replay.in_process import IN_PROCESS_RUNNERS, InProcessRunner, ReplayPubMaster
 from openpilot.tools.lib.logreader import LogIterable
 from openpilot.tools.lib.framereader import BaseFrameReader
 
@@ -267,55 +268,115 @@ class ProcessContainer:
       self._clean_env()
 
   def run_step(self, msg: capnp._DynamicStructReader, frs: Optional[Dict[str, BaseFrameReader]]) -> List[capnp._DynamicStructReader]:
+    end_of_cycle = True
+    if self.cfg.should_recv_callback is not None:
+      end_of_cycle = self.cfg.should_recv_callback(msg, self.cfg, self.cnt)
+
+    # messages are only sent to the process once per receive cycle, so only enter the prefix and timeout then
+    self.msg_queue.append(msg)
+    if not end_of_cycle:
+      return []
+
+    with self.prefix, Timeout(self.cfg.timeout, error_msg=f"timed out testing process {repr(self.cfg.proc_name)}"):
+      return self._run_cycle(msg, frs)
+
+  def _run_cycle(self, msg: capnp._DynamicStructReader, frs: Optional[Dict[str, BaseFrameReader]]) -> List[capnp._DynamicStructReader]:
     assert self.rc and self.pm and self.sockets and self.process.proc
 
+    self.rc.wait_for_recv_called()
+
+    # call recv to let sub-sockets reconnect, after we know the process is ready
+    if self.cnt == 0:
+      for s in self.sockets:
+        messaging.recv_one_or_none(s)
+
+    # empty recv on drained pub indicates the end of messages, only do that if there're any
+    trigger_empty_recv = False
+    if self.cfg.main_pub and self.cfg.main_pub_drained:
+      trigger_empty_recv = any(m.which() == self.cfg.main_pub for m in self.msg_queue)
+
+    for m in self.msg_queue:
+      self.pm.send(m.which(), m.as_builder())
+      # send frames if needed
+      if self.vipc_server is not None and m.which() in self.cfg.vision_pubs:
+        camera_state = getattr(m, m.which())
+        camera_meta = meta_from_camera_state(m.which())
+        assert frs is not None
+        img = frs[m.which()].get(camera_state.frameId, pix_fmt="nv12")[0]
+        self.vipc_server.send(camera_meta.stream, img.flatten().tobytes(),
+                              camera_state.frameId, camera_state.timestampSof, camera_state.timestampEof)
+    self.msg_queue = []
+
+    self.rc.unlock_sockets()
+    self.rc.wait_for_next_recv(trigger_empty_recv)
+
     output_msgs = []
-    with self.prefix, Timeout(self.cfg.timeout, error_msg=f"timed out testing process {repr(self.cfg.proc_name)}"):
-      end_of_cycle = True
-      if self.cfg.should_recv_callback is not None:
-        end_of_cycle = self.cfg.should_recv_callback(msg, self.cfg, self.cnt)
-
-      self.msg_queue.append(msg)
-      if end_of_cycle:
-        self.rc.wait_for_recv_called()
-
-        # call recv to let sub-sockets reconnect, after we know the process is ready
-        if self.cnt == 0:
-          for s in self.sockets:
-            messaging.recv_one_or_none(s)
-
-        # empty recv on drained pub indicates the end of messages, only do that if there're any
-        trigger_empty_recv = False
-        if self.cfg.main_pub and self.cfg.main_pub_drained:
-          trigger_empty_recv = next((True for m in self.msg_queue if m.which() == self.cfg.main_pub), False)
-
-        for m in self.msg_queue:
-          self.pm.send(m.which(), m.as_builder())
-          # send frames if needed
-          if self.vipc_server is not None and m.which() in self.cfg.vision_pubs:
-            camera_state = getattr(m, m.which())
-            camera_meta = meta_from_camera_state(m.which())
-            assert frs is not None
-            img = frs[m.which()].get(camera_state.frameId, pix_fmt="nv12")[0]
-            self.vipc_server.send(camera_meta.stream, img.flatten().tobytes(),
-                                  camera_state.frameId, camera_state.timestampSof, camera_state.timestampEof)
-        self.msg_queue = []
-
-        self.rc.unlock_sockets()
-        self.rc.wait_for_next_recv(trigger_empty_recv)
-
-        for socket in self.sockets:
-          ms = messaging.drain_sock(socket)
-          for m in ms:
-            m = m.as_builder()
-            m.logMonoTime = msg.logMonoTime + int(self.cfg.processing_time * 1e9)
-            output_msgs.append(m.as_reader())
-        self.cnt += 1
+    log_mono_time = msg.logMonoTime + int(self.cfg.processing_time * 1e9)
+    for socket in self.sockets:
+      for m in messaging.drain_sock(socket):
+        m = m.as_builder()
+        m.logMonoTime = log_mono_time
+        output_msgs.append(m.as_reader())
+    self.cnt += 1
     assert self.process.proc.is_alive()
 
     return output_msgs
 
 
+class InProcessContainer(ProcessContainer):
+  """
+  Runs a Python daemon's step function in the replay process (see IN_PROCESS_RUNNERS),
+  instead of launching the daemon and synchronizing with it through fake msgq events.
+  """
+  def __init__(self, cfg: ProcessConfig):
+    super().__init__(cfg)
+    self.runner: Optional[InProcessRunner] = None
+
+  def start(
+    self, params_config: Dict[str, Any], environ_config: Dict[str, Any],
+    all_msgs: LogIterable, frs: Optional[Dict[str, BaseFrameReader]],
+    fingerprint: Optional[str], capture_output: bool
+  ):
+    assert not capture_output, f"cannot capture output of {repr(self.cfg.proc_name)} in-process"
+    assert len(self.cfg.vision_pubs) == 0
+
+    with self.prefix:
+      self._setup_env(params_config, environ_config)
+
+      if self.cfg.config_callback is not None:
+        params = Params()
+        self.cfg.config_callback(params, self.cfg, all_msgs)
+
+      # the init callbacks of the supported processes only prepare params, they don't need to sync with the process
+      if self.cfg.init_callback is not None:
+        self.cfg.init_callback(None, None, all_msgs, fingerprint)
+
+      self.pm = ReplayPubMaster(self.cfg.subs)
+      self.runner = IN_PROCESS_RUNNERS[self.cfg.proc_name](self.pm)
+
+  def stop(self):
+    with self.prefix:
+      self.prefix.clean_dirs()
+      self._clean_env()
+
+  def _run_cycle(self, msg: capnp._DynamicStructReader, frs: Optional[Dict[str, BaseFrameReader]]) -> List[capnp._DynamicStructReader]:
+    assert self.runner is not None and isinstance(self.pm, ReplayPubMaster)
+
+    self.runner.step(self.msg_queue)
+    self.msg_queue = []
+
+    output_msgs = []
+    log_mono_time = msg.logMonoTime + int(self.cfg.processing_time * 1e9)
+    for s in self.cfg.subs:
+      for m in self.pm.drain(s):
+        m = m.as_builder()
+        m.logMonoTime = log_mono_time
+        output_msgs.append(m.as_reader())
+    self.cnt += 1
+
+    return output_msgs
+
+
 def controlsd_fingerprint_callback(rc, pm, msgs, fingerprint):
   print("start fingerprinting")
   params = Params()
@@ -624,21 +685,37 @@ def replay_process_with_name(name: Union[str, Iterable[str]], lr: LogIterable, *
   return replay_process(cfgs, lr, *args, **kwargs)
 
 
+def get_migration_config(cfgs: Iterable[ProcessConfig]) -> Dict[str, bool]:
+  cfgs = list(cfgs)
+  return {
+    "old_logtime": True,
+    "manager_states": True,
+    "panda_states": any("pandaStates" in cfg.pubs for cfg in cfgs),
+    "camera_states": any(len(cfg.vision_pubs) != 0 for cfg in cfgs),
+  }
+
+
 def replay_process(
   cfg: Union[ProcessConfig, Iterable[ProcessConfig]], lr: LogIterable, frs: Optional[Dict[str, BaseFrameReader]] = None,
   fingerprint: Optional[str] = None, return_all_logs: bool = False, custom_params: Optional[Dict[str, Any]] = None,
-  captured_output_store: Optional[Dict[str, Dict[str, str]]] = None, disable_progress: bool = False
+  captured_output_store: Optional[Dict[str, Dict[str, str]]] = None, disable_progress: bool = False, migrate: bool = True,
+  in_process: bool = False
 ) -> List[capnp._DynamicStructReader]:
+  """
+  Replays logs through the given processes and returns their output.
+  Pass migrate=False if lr was already migrated with migrate_all(lr, **get_migration_config(cfgs)).
+  With in_process=True, processes in IN_PROCESS_RUNNERS are stepped in this process instead of being launched.
+  """
   if isinstance(cfg, Iterable):
     cfgs = list(cfg)
   else:
     cfgs = [cfg]
 
-  all_msgs = migrate_all(lr, old_logtime=True,
-                         manager_states=True,
-                         panda_states=any("pandaStates" in cfg.pubs for cfg in cfgs),
-                         camera_states=any(len(cfg.vision_pubs) != 0 for cfg in cfgs))
-  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress)
+  if migrate:
+    all_msgs = migrate_all(lr, **get_migration_config(cfgs))
+  else:
+    all_msgs = list(lr)
+  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress, in_process)
 
   if return_all_logs:
     keys = {m.which() for m in process_logs}
@@ -654,7 +731,8 @@ def replay_process(
 
 def _replay_multi_process(
   cfgs: List[ProcessConfig], lr: LogIterable, frs: Optional[Dict[str, BaseFrameReader]], fingerprint: Optional[str],
-  custom_params: Optional[Dict[str, Any]], captured_output_store: Optional[Dict[str, Dict[str, str]]], disable_progress: bool
+  custom_params: Optional[Dict[str, Any]], captured_output_store: Optional[Dict[str, Dict[str, str]]], disable_progress: bool,
+  in_process: bool = False
 ) -> List[capnp._DynamicStructReader]:
   if fingerprint is not None:
     params_config = generate_params_config(lr=lr, fingerprint=fingerprint, custom_params=custom_params)
@@ -678,7 +756,7 @@ def _replay_multi_process(
   try:
     containers = []
     for cfg in cfgs:
-      container = ProcessContainer(cfg)
+      container = InProcessContainer(cfg) if in_process and cfg.proc_name in IN_PROCESS_RUNNERS else ProcessContainer(cfg)
       containers.append(container)
       container.start(params_config, env_config, all_msgs, frs, fingerprint, captured_output_store is not None)
 
@@ -688,28 +766,27 @@ def _replay_multi_process(
     pubs_to_containers = {pub: [container for container in containers if pub in container.pubs] for pub in all_pubs}
 
     pub_msgs = [msg for msg in all_msgs if msg.which() in lr_pubs]
-    # external queue for messages taken from logs; internal queue for messages generated by processes, which will be republished
-    external_pub_queue: List[capnp._DynamicStructReader] = pub_msgs.copy()
-    internal_pub_queue: List[capnp._DynamicStructReader] = []
-    # heap for maintaining the order of messages generated by processes, where each element: (logMonoTime, index in internal_pub_queue)
-    internal_pub_index_heap: List[Tuple[int, int]] = []
-
-    pbar = tqdm(total=len(external_pub_queue), disable=disable_progress)
-    while len(external_pub_queue) != 0 or (len(internal_pub_index_heap) != 0 and not all(c.has_empty_queue for c in containers)):
-      if len(internal_pub_index_heap) == 0 or (len(external_pub_queue) != 0 and external_pub_queue[0].logMonoTime < internal_pub_index_heap[0][0]):
-        msg = external_pub_queue.pop(0)
+    # messages taken from logs are already sorted, they're consumed with a cursor instead of popping the front of a list.
+    # messages generated by processes are republished in order from a heap of (logMonoTime, sequence number, message)
+    pub_idx = 0
+    internal_pub_heap: List[Tuple[int, int, capnp._DynamicStructReader]] = []
+    internal_pub_cnt = 0
+
+    pbar = tqdm(total=len(pub_msgs), disable=disable_progress)
+    while pub_idx < len(pub_msgs) or (len(internal_pub_heap) != 0 and not all(c.has_empty_queue for c in containers)):
+      if len(internal_pub_heap) == 0 or (pub_idx < len(pub_msgs) and pub_msgs[pub_idx].logMonoTime < internal_pub_heap[0][0]):
+        msg = pub_msgs[pub_idx]
+        pub_idx += 1
         pbar.update(1)
       else:
-        _, index = heapq.heappop(internal_pub_index_heap)
-        msg = internal_pub_queue[index]
+        _, _, msg = heapq.heappop(internal_pub_heap)
 
-      target_containers = pubs_to_containers[msg.which()]
-      for container in target_containers:
+      for container in pubs_to_containers[msg.which()]:
         output_msgs = container.run_step(msg, frs)
         for m in output_msgs:
           if m.which() in all_pubs:
-            internal_pub_queue.append(m)
-            heapq.heappush(internal_pub_index_heap, (m.logMonoTime, len(internal_pub_queue) - 1))
+            heapq.heappush(internal_pub_heap, (m.logMonoTime, internal_pub_cnt, m))
+            internal_pub_cnt += 1
         log_msgs.extend(output_msgs)
   finally:
     for container in containers:
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import time
+import unittest
+
+from parameterized import parameterized
+
+from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs
+from openpilot.selfdrive.test.process_replay.in_process import IN_PROCESS_RUNNERS
+from openpilot.selfdrive.test.process_replay.process_replay import get_process_config, replay_process
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.openpilotci import get_url
+
+TEST_SEGMENT = "regen5C019D76307|2023-10-30--23-13-31--0"  # TOYOTA PRIUS 2017
+
+
+class TestInProcessReplay(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.lr = list(LogReader(get_url(*TEST_SEGMENT.rsplit("--", 1))))
+
+  @parameterized.expand([(proc_name,) for proc_name in IN_PROCESS_RUNNERS])
+  def test_same_output(self, proc_name):
+    cfg = get_process_config(proc_name)
+
+    start = time.monotonic()
+    expected = replay_process(cfg, self.lr, disable_progress=True)
+    subprocess_time = time.monotonic() - start
+
+    start = time.monotonic()
+    actual = replay_process(cfg, self.lr, disable_progress=True, in_process=True)
+    in_process_time = time.monotonic() - start
+    print(f"{proc_name}: subprocess {subprocess_time:.2f}s, in-process {in_process_time:.2f}s")
+
+    self.assertGreater(len(expected), 0)
+    diff = compare_logs(expected, actual, cfg.ignore, tolerance=cfg.tolerance)
+    self.assertEqual(len(diff), 0, diff[:10])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -3,6 +3,7 @@ import argparse
 import concurrent.futures
 import os
 import sys
+import tempfile
 from collections import defaultdict
 from tqdm import tqdm
 from typing import Any, DefaultDict, Dict
@@ -10,7 +11,9 @@ from typing import Any, DefaultDict, Dict
 from openpilot.selfdrive.car.car_helpers import interface_names
 from openpilot.tools.lib.openpilotci import get_url, upload_file
 from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs, format_diff
-from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, PROC_REPLAY_DIR, FAKEDATA, check_openpilot_enabled, replay_process
+from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, PROC_REPLAY_DIR, FAKEDATA, check_openpilot_enabled, get_migration_config, \
+                                                                 replay_process
 from openpilot.system.version import get_commit
 from openpilot.tools.lib.filereader import FileReader
 from openpilot.tools.lib.logreader import LogReader
@@ -69,10 +72,10 @@ EXCLUDED_PROCS = {"modeld", "dmonitoringmodeld"}
 
 
 def run_test_process(data):
-  segment, cfg, args, cur_log_fn, ref_log_path, lr_dat = data
+  segment, cfg, args, cur_log_fn, ref_log_path, migrated_log_fn = data
   res = None
   if not args.upload_only:
-    lr = LogReader.from_bytes(lr_dat)
+    lr = LogReader(migrated_log_fn)
     res, log_msgs = test_process(cfg, lr, segment, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs)
     # save logs so we can upload when updating refs
     save_log(cur_log_fn, log_msgs)
@@ -85,10 +88,22 @@ def run_test_process(data):
   return (segment, cfg.proc_name, res)
 
 
-def get_log_data(segment):
+def get_migrated_log_fn(migrated_dir, segment, migration_config):
+  flags = "_".join(k for k, v in migration_config.items() if v)
+  return os.path.join(migrated_dir, f"{segment}_migrated_{flags}")
+
+
+def get_log_data(data):
+  # decompress and migrate each segment once for every migration config,
+  # the test jobs then read the uncompressed logs from disk (sharing the page cache) instead
+  segment, migration_configs, migrated_dir = data
   r, n = segment.rsplit("--", 1)
   with FileReader(get_url(r, n)) as f:
-    return (segment, f.read())
+    lr = list(LogReader.from_bytes(f.read()))
+
+  for migration_config in migration_configs:
+    save_log(get_migrated_log_fn(migrated_dir, segment, migration_config), migrate_all(lr, **migration_config), compress=False)
+  return segment
 
 
 def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None):
@@ -100,7 +115,7 @@ def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=Non
   ref_log_msgs = list(LogReader(ref_log_path))
 
   try:
-    log_msgs = replay_process(cfg, lr, disable_progress=True)
+    log_msgs = replay_process(cfg, lr, disable_progress=True, migrate=False)
   except Exception as e:
     raise Exception("failed on segment: " + segment) from e
 
@@ -170,24 +185,24 @@ if __name__ == "__main__":
     untested = (set(interface_names) - set(excluded_interfaces)) - {c.lower() for c in tested_cars}
     assert len(untested) == 0, f"Cars missing routes: {str(untested)}"
 
+  tested_cfgs = [cfg for cfg in CONFIGS if cfg.proc_name in tested_procs]
+  migration_configs = [dict(c) for c in {tuple(get_migration_config([cfg]).items()) for cfg in tested_cfgs}]
+
   log_paths: DefaultDict[str, Dict[str, Dict[str, str]]] = defaultdict(lambda: defaultdict(dict))
-  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+  # the uncompressed migrated logs are removed with their directory, even if a test job raises
+  with tempfile.TemporaryDirectory(dir=FAKEDATA) as migrated_dir, concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
     if not args.upload_only:
       download_segments = [seg for car, seg in segments if car in tested_cars]
-      log_data: Dict[str, LogReader] = {}
-      p1 = pool.map(get_log_data, download_segments)
-      for segment, lr in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
-        log_data[segment] = lr
+      p1 = pool.map(get_log_data, [(seg, migration_configs, migrated_dir) for seg in download_segments])
+      for _ in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
+        pass
 
     pool_args: Any = []
     for car_brand, segment in segments:
       if car_brand not in tested_cars:
         continue
 
-      for cfg in CONFIGS:
-        if cfg.proc_name not in tested_procs:
-          continue
-
+      for cfg in tested_cfgs:
         cur_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{cur_commit}.bz2")
         if args.update_refs:  # reference logs will not exist if routes were just regenerated
           ref_log_path = get_url(*segment.rsplit("--", 1))
@@ -195,8 +210,8 @@ if __name__ == "__main__":
           ref_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{ref_commit}.bz2")
           ref_log_path = ref_log_fn if os.path.exists(ref_log_fn) else BASE_URL + os.path.basename(ref_log_fn)
 
-        dat = None if args.upload_only else log_data[segment]
-        pool_args.append((segment, cfg, args, cur_log_fn, ref_log_path, dat))
+        migrated_log_fn = None if args.upload_only else get_migrated_log_fn(migrated_dir, segment, get_migration_config([cfg]))
+        pool_args.append((segment, cfg, args, cur_log_fn, ref_log_path, migrated_log_fn))
 
         log_paths[segment][cfg.proc_name]['ref'] = ref_log_path
         log_paths[segment][cfg.proc_name]['new'] = cur_log_fn
@@ -27,3 +27,15 @@ def get_available_bytes(default=None):
     available_bytes = default
 
   return available_bytes
+
+
+def get_bytes_to_free(min_bytes, min_percent, default=0):
+  """Bytes that need to be freed for both get_available_bytes() >= min_bytes and get_available_percent() >= min_percent."""
+  try:
+    statvfs = os.statvfs(Paths.log_root())
+  except OSError:
+    return default
+
+  available_bytes = statvfs.f_bavail * statvfs.f_frsize
+  min_available_bytes = max(min_bytes, statvfs.f_blocks * statvfs.f_frsize * min_percent / 100)
+  return max(0, int(min_available_bytes - available_bytes))
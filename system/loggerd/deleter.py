@@ -2,13 +2,18 @@
 import os
 import shutil
 import threading
-from typing import List
+import time
+from typing import Dict, Iterator, List, Tuple
+
+import psutil
+
 from openpilot.system.hardware.hw import Paths
 from openpilot.common.swaglog import cloudlog
-from openpilot.system.loggerd.config import get_available_bytes, get_available_percent
-from openpilot.system.loggerd.uploader import listdir_by_creation
+from openpilot.system.loggerd.config import get_bytes_to_free
+from openpilot.system.loggerd.uploader import MTIME_SETTLE_NS, listdir_by_creation
 from openpilot.system.loggerd.xattr_cache import getxattr
 
+# also leaves room for the compressed copy of a log the uploaders write to the log partition while uploading it
 MIN_BYTES = 5 * 1024 * 1024 * 1024
 MIN_PERCENT = 10
 
@@ -45,33 +50,77 @@ def get_preserved_segments(dirs_by_creation: List[str]) -> List[str]:
   return preserved
 
 
+class DeletionPlan:
+  """Log directories in the order they should be deleted, with their size on disk.
+  A directory is only listed again when its mtime changes, e.g. when its lock file is removed.
+  DELETE_LAST directories are always listed, their files keep growing without changing the directory's mtime."""
+  def __init__(self, root: str):
+    self.root = root
+    # directory -> (mtime when listed, has lock file, size in bytes)
+    self.dirs: Dict[str, Tuple[int, bool, int]] = {}
+
+  def dir_info(self, d: str) -> Tuple[bool, int]:
+    path = os.path.join(self.root, d)
+    mtime = os.stat(path).st_mtime_ns
+    if d in self.dirs and self.dirs[d][0] == mtime:
+      return self.dirs[d][1:]
+
+    locked, size = False, 0
+    with os.scandir(path) as entries:
+      for entry in entries:
+        locked |= entry.name.endswith(".lock")
+        size += entry.stat(follow_symlinks=False).st_blocks * 512
+
+    # a lock file created in the same mtime tick wouldn't change it, list it again next time
+    if d not in DELETE_LAST and time.time_ns() - mtime >= MTIME_SETTLE_NS:
+      self.dirs[d] = (mtime, locked, size)
+    return locked, size
+
+  def candidates(self) -> Iterator[Tuple[str, int]]:
+    """Yields (directory, size) in deletion order, checking for a lock file right before each one."""
+    dirs = listdir_by_creation(self.root)
+    for d in self.dirs.keys() - set(dirs):
+      del self.dirs[d]
+
+    # skip deleting most recent N preserved segments (and their prior segment)
+    preserved_dirs = get_preserved_segments(dirs)
+
+    for d in sorted(dirs, key=lambda d: (d in DELETE_LAST, d in preserved_dirs)):
+      try:
+        locked, size = self.dir_info(d)
+      except OSError:
+        continue
+      if not locked:
+        yield d, size
+
+
+def delete_dirs(plan: DeletionPlan, bytes_to_free: int) -> int:
+  """Deletes the earliest directories we can until bytes_to_free are freed, returns the bytes freed."""
+  freed = 0
+  for delete_dir, size in plan.candidates():
+    delete_path = os.path.join(plan.root, delete_dir)
+    try:
+      cloudlog.info(f"deleting {delete_path}")
+      shutil.rmtree(delete_path)
+      freed += size
+    except OSError:
+      cloudlog.exception(f"issue deleting {delete_path}")
+
+    if freed >= bytes_to_free:
+      break
+  return freed
+
+
 def deleter_thread(exit_event):
+  # don't compete with loggerd for disk bandwidth
+  if psutil.LINUX:
+    psutil.Process(threading.get_native_id()).ionice(psutil.IOPRIO_CLASS_BE, value=7)
+
+  plan = DeletionPlan(Paths.log_root())
   while not exit_event.is_set():
-    out_of_bytes = get_available_bytes(default=MIN_BYTES + 1) < MIN_BYTES
-    out_of_percent = get_available_percent(default=MIN_PERCENT + 1) < MIN_PERCENT
-
-    if out_of_percent or out_of_bytes:
-      dirs = listdir_by_creation(Paths.log_root())
-
-      # skip deleting most recent N preserved segments (and their prior segment)
-      preserved_dirs = get_preserved_segments(dirs)
-
-      # remove the earliest directory we can
-      for delete_dir in sorted(dirs, key=lambda d: (d in DELETE_LAST, d in preserved_dirs)):
-        delete_path = os.path.join(Paths.log_root(), delete_dir)
-
-        if any(name.endswith(".lock") for name in os.listdir(delete_path)):
-          continue
-
-        try:
-          cloudlog.info(f"deleting {delete_path}")
-          if os.path.isfile(delete_path):
-            os.remove(delete_path)
-          else:
-            shutil.rmtree(delete_path)
-          break
-        except OSError:
-          cloudlog.exception(f"issue deleting {delete_path}")
+    bytes_to_free = get_bytes_to_free(MIN_BYTES, MIN_PERCENT)
+    if bytes_to_free > 0:
+      delete_dirs(plan, bytes_to_free)
       exit_event.wait(.1)
     else:
       exit_event.wait(30)
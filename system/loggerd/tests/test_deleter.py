@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import os
+import shutil
 import time
 import threading
 import unittest
@@ -7,7 +9,8 @@ from pathlib import Path
 from typing import Sequence
 
 import openpilot.system.loggerd.deleter as deleter
-from openpilot.common.timeout import Timeout, TimeoutException
+from openpilot.common.timeout import Timeout
+from openpilot.system.hardware.hw import Paths
 from openpilot.system.loggerd.tests.loggerd_tests_common import UploaderTestCase
 
 Stats = namedtuple("Stats", ['f_bavail', 'f_blocks', 'f_frsize'])
@@ -20,6 +23,7 @@ class TestDeleter(UploaderTestCase):
   def setUp(self):
     self.f_type = "fcamera.hevc"
     super().setUp()
+    shutil.rmtree(Paths.log_root(), ignore_errors=True)
     self.fake_stats = Stats(f_bavail=0, f_blocks=10, f_frsize=4096)
     deleter.os.statvfs = self.fake_statvfs
 
@@ -45,26 +49,11 @@ class TestDeleter(UploaderTestCase):
     finally:
       self.join_thread()
 
-  def assertDeleteOrder(self, f_paths: Sequence[Path], timeout: int = 5) -> None:
-    deleted_order = []
-
-    self.start_thread()
-    try:
-      with Timeout(timeout, "Timeout waiting for files to be deleted"):
-        while True:
-          for f in f_paths:
-            if not f.exists() and f not in deleted_order:
-              deleted_order.append(f)
-          if len(deleted_order) == len(f_paths):
-            break
-          time.sleep(0.01)
-    except TimeoutException:
-      print("Not deleted:", [f for f in f_paths if f not in deleted_order])
-      raise
-    finally:
-      self.join_thread()
-
-    self.assertEqual(deleted_order, f_paths, "Files not deleted in expected order")
+  def assertDeleteOrder(self, f_paths: Sequence[Path]) -> None:
+    # one pass of the deleter thread frees enough space to delete all of them, so check the order the plan lists them in
+    plan = deleter.DeletionPlan(Paths.log_root())
+    expected = [str(f.parent.relative_to(Paths.log_root())) for f in f_paths]
+    self.assertEqual([d for d, _ in plan.candidates()], expected, "Files not deleted in expected order")
 
   def test_delete_order(self):
     self.assertDeleteOrder([
@@ -92,6 +81,31 @@ class TestDeleter(UploaderTestCase):
       self.make_file_with_data("crash", self.seg_format2[:-4]),
     ])
 
+  def test_delete_enough_in_one_pass(self):
+    f_paths = [self.make_file_with_data(self.seg_format.format(i), self.f_type, 1) for i in range(5)]
+    sizes = [os.stat(f).st_blocks * 512 for f in f_paths]
+
+    plan = deleter.DeletionPlan(Paths.log_root())
+    self.assertEqual([size for _, size in plan.candidates()], sizes)
+
+    freed = deleter.delete_dirs(plan, sum(sizes[:2]) + 1)
+    self.assertEqual(freed, sum(sizes[:3]))
+    self.assertEqual([f.exists() for f in f_paths], [False] * 3 + [True] * 2)
+
+  def test_delete_last_size_not_cached(self):
+    f_path = self.make_file_with_data("boot", self.seg_format[:-4])
+    # old enough for the directory's listing to be cached
+    mtime = time.time_ns() - 2 * deleter.MTIME_SETTLE_NS
+    os.utime(f_path.parent, ns=(mtime, mtime))
+
+    plan = deleter.DeletionPlan(Paths.log_root())
+    self.assertEqual(list(plan.candidates()), [("boot", os.stat(f_path).st_blocks * 512)])
+
+    # appending to a file doesn't change the directory's mtime
+    with open(f_path, "ab") as f:
+      f.write(os.urandom(1024 * 1024))
+    self.assertEqual(list(plan.candidates()), [("boot", os.stat(f_path).st_blocks * 512)])
+
   def test_no_delete_when_available_space(self):
     f_path = self.make_file_with_data(self.seg_dir, self.f_type)
 
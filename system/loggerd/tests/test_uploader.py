@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import shutil
 import time
 import threading
 import unittest
@@ -10,7 +11,7 @@ from typing import List, Optional
 from openpilot.system.hardware.hw import Paths
 
 from openpilot.common.swaglog import cloudlog
-from openpilot.system.loggerd.uploader import main, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
+from openpilot.system.loggerd.uploader import main, UploadIndex, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
 
 from openpilot.system.loggerd.tests.loggerd_tests_common import UploaderTestCase
 
@@ -151,6 +152,23 @@ class TestUploader(UploaderTestCase):
 
     self.assertTrue(log_handler.upload_order == exp_order, "Files uploaded in wrong order")
 
+  def test_upload_files_created_after_start(self):
+    self.start_thread()
+
+    time.sleep(0.25)
+    seg_nums = [0, 1, 2]
+    for i in seg_nums:
+      self.seg_dir = self.seg_format.format(i)
+      self.gen_files(boot=False)
+      time.sleep(0.25)
+
+    # allow enough time that files could upload twice if there is a bug in the logic
+    time.sleep(5)
+    self.join_thread()
+
+    exp_order = self.gen_order(seg_nums, [], boot=False)
+    self.assertTrue(log_handler.upload_order == exp_order, "Files uploaded in wrong order")
+
   def test_no_upload_with_lock_file(self):
     self.start_thread()
 
@@ -176,6 +194,22 @@ class TestUploader(UploaderTestCase):
 
     self.assertEqual(len(log_handler.upload_order), 0, "File uploaded again")
 
+  def test_index_dir_created_in_same_mtime_tick(self):
+    root = Paths.log_root()
+    shutil.rmtree(root, ignore_errors=True)
+    index = UploadIndex(root, ["crash/", "boot/"], {"qlog": 0})
+    self.make_file_with_data(self.seg_format.format(0), "qlog")
+    index.update()
+
+    # a directory created right after listing the root, without changing its mtime
+    root_mtime = os.stat(root).st_mtime_ns
+    self.make_file_with_data(self.seg_format.format(1), "qlog")
+    os.utime(root, ns=(root_mtime, root_mtime))
+
+    index.update()
+    self.assertIn(self.seg_format.format(1), index.dirs)
+    self.assertEqual([key[2] for key in index.queue], [self.seg_format.format(0), self.seg_format.format(1)])
+
   def test_clear_locks_on_startup(self):
     f_paths = self.gen_files(lock=True, boot=False)
     self.start_thread()
@@ -1,6 +1,4 @@
 #!/usr/bin/env python3
-import bz2
-import io
 import json
 import os
 import random
@@ -9,11 +7,14 @@ import threading
 import time
 import traceback
 import datetime
-from typing import BinaryIO, Iterator, List, Optional, Tuple
+from bisect import bisect_left, insort
+from functools import partial
+from typing import IO, Dict, Iterator, List, Optional, Tuple
 
 from cereal import log
 import cereal.messaging as messaging
 from openpilot.common.api import Api
+from openpilot.common.file_helpers import bz2_compress_to_tempfile
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware.hw import Paths
@@ -30,6 +31,12 @@ allow_sleep = bool(os.getenv("UPLOADER_SLEEP", "1"))
 force_wifi = os.getenv("FORCEWIFI") is not None
 fake_upload = os.getenv("FAKEUPLOAD") is not None
 
+# a directory modified this recently may still change within the same mtime tick, list it again next time
+MTIME_SETTLE_NS = int(2e9)
+
+# (tier, directory sort, directory, priority, name)
+IndexKey = Tuple[int, List[str], str, int, str]
+
 
 class FakeRequest:
   def __init__(self):
@@ -68,6 +75,93 @@ def clear_locks(root: str) -> None:
       cloudlog.exception("clear_locks failed")
 
 
+class UploadIndex:
+  """Files the uploader may upload, kept sorted in upload order. A directory is only listed
+  again when its mtime changes, so finding the next file doesn't rescan the whole log root."""
+  def __init__(self, root: str, immediate_folders: List[str], immediate_priority: Dict[str, int]):
+    self.root = root
+    self.immediate_folders = immediate_folders
+    self.immediate_priority = immediate_priority
+
+    self.root_mtime: Optional[int] = None
+    # logdir -> (mtime when listed, has lock file, keys)
+    self.dirs: Dict[str, Tuple[Optional[int], bool, List[IndexKey]]] = {}
+    self.queue: List[IndexKey] = []
+
+  def __len__(self) -> int:
+    return len(self.queue)
+
+  def sort_key(self, logdir: str, name: str) -> Optional[IndexKey]:
+    # immediate folders first, then qlogs and qcameras, the rest is never uploaded by the uploader
+    if any(f in os.path.join(self.root, logdir, name) for f in self.immediate_folders):
+      tier = 0
+    elif name in self.immediate_priority:
+      tier = 1
+    else:
+      return None
+    return tier, get_directory_sort(logdir), logdir, self.immediate_priority.get(name, 1000), name
+
+  def remove(self, key: IndexKey) -> None:
+    i = bisect_left(self.queue, key)
+    if i < len(self.queue) and self.queue[i] == key:
+      del self.queue[i]
+
+  def remove_file(self, logdir: str, name: str) -> None:
+    key = self.sort_key(logdir, name)
+    if key is not None:
+      self.remove(key)
+
+  def _remove_dir(self, logdir: str) -> None:
+    for key in self.dirs.pop(logdir)[2]:
+      self.remove(key)
+
+  def _list_dir(self, logdir: str, mtime: Optional[int]) -> None:
+    try:
+      names = os.listdir(os.path.join(self.root, logdir))
+    except OSError:
+      names, mtime = [], None
+
+    keys = [k for k in map(partial(self.sort_key, logdir), names) if k is not None]
+    for key in keys:
+      insort(self.queue, key)
+
+    if mtime is not None and time.time_ns() - mtime < MTIME_SETTLE_NS:
+      mtime = None
+    self.dirs[logdir] = (mtime, any(name.endswith(".lock") for name in names), keys)
+
+  def update(self) -> None:
+    try:
+      root_mtime: Optional[int] = os.stat(self.root).st_mtime_ns
+    except OSError:
+      root_mtime = None
+
+    if root_mtime is None or root_mtime != self.root_mtime:
+      logdirs = set(listdir_by_creation(self.root))
+      for logdir in self.dirs.keys() - logdirs:
+        self._remove_dir(logdir)
+      for logdir in logdirs - self.dirs.keys():
+        self.dirs[logdir] = (None, False, [])
+      # like the log dirs, a directory created in the same mtime tick wouldn't change it, list it again next time
+      if root_mtime is not None and time.time_ns() - root_mtime < MTIME_SETTLE_NS:
+        root_mtime = None
+      self.root_mtime = root_mtime
+
+    # stat mtime before listing, so changes made while listing are picked up next time
+    for logdir, (listed_mtime, _, _) in list(self.dirs.items()):
+      try:
+        mtime = os.stat(os.path.join(self.root, logdir)).st_mtime_ns
+      except OSError:
+        self._remove_dir(logdir)
+        continue
+
+      if listed_mtime is None or mtime != listed_mtime:
+        self._remove_dir(logdir)
+        self._list_dir(logdir, mtime)
+
+  def is_locked(self, logdir: str) -> bool:
+    return self.dirs[logdir][1]
+
+
 class Uploader:
   def __init__(self, dongle_id: str, root: str):
     self.dongle_id = dongle_id
@@ -75,65 +169,61 @@ class Uploader:
     self.root = root
 
     self.params = Params()
+    # keep the connection to the upload host alive between files
+    self.session = requests.Session()
 
     # stats for last successfully uploaded file
     self.last_filename = ""
 
     self.immediate_folders = ["crash/", "boot/"]
     self.immediate_priority = {"qlog": 0, "qlog.bz2": 0, "qcamera.ts": 1}
+    self.index = UploadIndex(self.root, self.immediate_folders, self.immediate_priority)
 
   def list_upload_files(self, metered: bool) -> Iterator[Tuple[str, str, str]]:
     r = self.params.get("AthenadRecentlyViewedRoutes", encoding="utf8")
     requested_routes = [] if r is None else r.split(",")
 
-    for logdir in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logdir)
+    self.index.update()
+
+    i = 0
+    while i < len(self.index.queue):
+      _, _, logdir, _, name = self.index.queue[i]
+      i += 1
+      if self.index.is_locked(logdir):
+        continue
+
+      key = os.path.join(logdir, name)
+      fn = os.path.join(self.root, logdir, name)
+      # skip files already uploaded
       try:
-        names = os.listdir(path)
+        ctime = os.path.getctime(fn)
+        is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
       except OSError:
+        cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
+        # deleter could have deleted, so skip
         continue
-
-      if any(name.endswith(".lock") for name in names):
+      if is_uploaded:
+        # never needs to be looked at again, unless the directory changes
+        i -= 1
+        del self.index.queue[i]
         continue
 
-      for name in sorted(names, key=lambda n: self.immediate_priority.get(n, 1000)):
-        key = os.path.join(logdir, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          ctime = os.path.getctime(fn)
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
-          # deleter could have deleted, so skip
+      # limit uploading on metered connections
+      if metered:
+        dt = datetime.timedelta(hours=12)
+        if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
           continue
-        if is_uploaded:
-          continue
-
-        # limit uploading on metered connections
-        if metered:
-          dt = datetime.timedelta(hours=12)
-          if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
-            continue
 
-          if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
-            continue
+        if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
+          continue
 
-        yield name, key, fn
+      yield name, key, fn
 
   def next_file_to_upload(self, metered: bool) -> Optional[Tuple[str, str, str]]:
-    upload_files = list(self.list_upload_files(metered))
-
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return name, key, fn
-
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return name, key, fn
-
-    return None
+    # the index is sorted in upload order, so this is usually the first entry
+    return next(self.list_upload_files(metered), None)
 
+  # the upload url is presigned for a single PUT, so the body must be a seekable file that's sent whole with a Content-Length
   def do_upload(self, key: str, fn: str):
     url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
     if url_resp.status_code == 412:
@@ -148,14 +238,15 @@ class Uploader:
       return FakeResponse()
 
     with open(fn, "rb") as f:
-      data: BinaryIO
+      data: IO[bytes]
       if key.endswith('.bz2') and not fn.endswith('.bz2'):
-        compressed = bz2.compress(f.read())
-        data = io.BytesIO(compressed)
+        # written to the log partition, which can be full until the deleter frees space
+        data = bz2_compress_to_tempfile(f, tmp_dir=os.path.dirname(fn))
       else:
         data = f
 
-      return requests.put(url, data=data, headers=headers, timeout=10)
+      with data:
+        return self.session.put(url, data=data, headers=headers, timeout=10)
 
   def upload(self, name: str, key: str, fn: str, network_type: int, metered: bool) -> bool:
     try:
@@ -177,8 +268,15 @@ class Uploader:
 
       stat = None
       last_exc = None
+      reason = None
       try:
         stat = self.do_upload(key, fn)
+      except requests.exceptions.RequestException as e:
+        last_exc = (e, traceback.format_exc())
+      except OSError as e:
+        # reading the file or writing its compressed copy failed, e.g. ENOSPC on a full log partition
+        last_exc = (e, traceback.format_exc())
+        reason = str(e)
       except Exception as e:
         last_exc = (e, traceback.format_exc())
 
@@ -195,12 +293,13 @@ class Uploader:
         success = True
       else:
         success = False
-        cloudlog.event("upload_failed", stat=stat, exc=last_exc, key=key, fn=fn, sz=sz, network_type=network_type, metered=metered)
+        cloudlog.event("upload_failed", stat=stat, exc=last_exc, reason=reason, key=key, fn=fn, sz=sz, network_type=network_type, metered=metered)
 
     if success:
       # tag file as uploaded
       try:
         setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+        self.index.remove_file(*os.path.split(os.path.relpath(fn, self.root)))
       except OSError:
         cloudlog.event("uploader_setxattr_failed", exc=last_exc, key=key, fn=fn, sz=sz)
 
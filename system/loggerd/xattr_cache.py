@@ -1,12 +1,18 @@
 import os
 import errno
-from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+from typing import Optional, Tuple
 
-_cached_attributes: Dict[Tuple, Optional[bytes]] = {}
+# entries for deleted files are never looked up again, so only keep the most recently used ones
+MAX_CACHED_ATTRIBUTES = 8192
+
+_cached_attributes: "OrderedDict[Tuple, Optional[bytes]]" = OrderedDict()
 
 def getxattr(path: str, attr_name: str) -> Optional[bytes]:
   key = (path, attr_name)
-  if key not in _cached_attributes:
+  if key in _cached_attributes:
+    _cached_attributes.move_to_end(key)
+  else:
     try:
       response = os.getxattr(path, attr_name)
     except OSError as e:
@@ -16,6 +22,8 @@ def getxattr(path: str, attr_name: str) -> Optional[bytes]:
       else:
         raise
     _cached_attributes[key] = response
+    if len(_cached_attributes) > MAX_CACHED_ATTRIBUTES:
+      _cached_attributes.popitem(last=False)
   return _cached_attributes[key]
 
 def setxattr(path: str, attr_name: str, attr_value: bytes) -> None:
@@ -1,7 +1,7 @@
 import os
 import requests
 
-from openpilot.tools.lib.url_file import URLFile
+from openpilot.tools.lib.url_file import URLFile, map_file
 
 DATA_ENDPOINT = os.getenv("DATA_ENDPOINT", "http://data-raw.comma.internal/")
 
@@ -16,8 +16,40 @@ def file_exists(fn):
     return requests.head(fn, allow_redirects=True).status_code == 200
   return os.path.exists(fn)
 
-def FileReader(fn, debug=False):
+class MappedFile:
+  """Local file reader backed by a memory map, read returns memoryviews into it without copying"""
+  def __init__(self, fn):
+    self.name = fn
+    self._map = map_file(fn)
+    self._pos = 0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def close(self):
+    # views handed out keep the map alive, it's unmapped once they are released
+    self._map = b""
+
+  def read(self, ll=None):
+    end = len(self._map) if ll is None else min(self._pos + ll, len(self._map))
+    ret = memoryview(self._map)[self._pos:end]
+    self._pos = max(self._pos, end)
+    return ret
+
+  def seek(self, pos):
+    self._pos = pos
+
+  def tell(self):
+    return self._pos
+
+
+def FileReader(fn, debug=False, zero_copy=False):
   fn = resolve_name(fn)
   if fn.startswith(("http://", "https://")):
-    return URLFile(fn, debug=debug)
+    return URLFile(fn, debug=debug, zero_copy=zero_copy)
+  if zero_copy:
+    return MappedFile(fn)
   return open(fn, "rb")
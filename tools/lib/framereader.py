@@ -4,11 +4,12 @@ import pickle
 import struct
 import subprocess
 import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
 from functools import wraps
 
 import numpy as np
-from lru import LRU
 
 import _io
 from openpilot.tools.lib.cache import cache_path_for_file_path, DEFAULT_CACHE_DIR
@@ -22,12 +23,29 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# "ffmpeg" to decode GOPs with an ffmpeg subprocess, or "av" to decode them in-process with PyAV
+DECODER_BACKEND = os.getenv("FRAMEREADER_DECODER", "ffmpeg")
+DECODER_WORKERS = int(os.getenv("FRAMEREADER_DECODER_WORKERS", str(os.cpu_count() or 1)))
+# memory budget of decoded frames, shared by all FrameReaders in the process
+FRAME_CACHE_BYTES = int(os.getenv("FRAMEREADER_FRAME_CACHE_MB", "1024")) * 1024 * 1024
+
 
 class GOPReader:
   def get_gop(self, num):
     # returns (start_frame_num, num_frames, frames_to_skip, gop_data)
     raise NotImplementedError
 
+  def get_gops(self, nums):
+    # returns get_gop for each distinct GOP containing the given frames
+    gops = []
+    covered = set()
+    for num in nums:
+      if num not in covered:
+        gop = self.get_gop(num)
+        covered.update(range(gop[0], gop[0] + gop[1]))
+        gops.append(gop)
+    return gops
+
 
 class DoNothingContextManager:
   def __enter__(self):
@@ -166,7 +184,18 @@ def rgb24tonv12(rgb):
   return nv12.clip(0, 255).astype('uint8')
 
 
-def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
+def frame_shape(w, h, pix_fmt):
+  if pix_fmt == "rgb24":
+    return (h, w, 3)
+  elif pix_fmt in ("nv12", "yuv420p"):
+    return (h*w*3//2,)
+  elif pix_fmt == "yuv444p":
+    return (3, h, w)
+  raise NotImplementedError
+
+
+def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt, out=None):
+  """Decodes a video with ffmpeg. If given, decoded frames are read straight into out, which must fit all of them"""
   threads = os.getenv("FFMPEG_THREADS", "0")
   cuda = os.getenv("FFMPEG_CUDA", "0") == "1"
   args = ["ffmpeg", "-v", "quiet",
@@ -181,20 +210,79 @@ def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
           "-f", "rawvideo",
           "-pix_fmt", pix_fmt,
           "-"]
-  dat = subprocess.check_output(args, input=rawdat)
+  if out is None:
+    dat = subprocess.check_output(args, input=rawdat)
+    return np.frombuffer(dat, dtype=np.uint8).reshape(-1, *frame_shape(w, h, pix_fmt))
 
-  if pix_fmt == "rgb24":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
-  elif pix_fmt == "nv12":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  elif pix_fmt == "yuv420p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  elif pix_fmt == "yuv444p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, 3, h, w)
-  else:
-    raise NotImplementedError
+  proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+  def write_thread():
+    try:
+      proc.stdin.write(rawdat)
+    except BrokenPipeError:
+      pass
+    finally:
+      proc.stdin.close()
 
-  return ret
+  t = threading.Thread(target=write_thread, daemon=True)
+  t.start()
+  try:
+    buf = memoryview(out.reshape(-1))
+    read = 0
+    while read < len(buf) and (n := proc.stdout.readinto(buf[read:])):
+      read += n
+    extra = proc.stdout.read()
+    if proc.wait() != 0:
+      raise subprocess.CalledProcessError(proc.returncode, args)
+    assert read == len(buf) and len(extra) == 0, (read + len(extra), len(buf))
+  finally:
+    proc.kill()
+    t.join()
+  return out
+
+
+def decompress_video_data_av(rawdat, vid_fmt, w, h, pix_fmt, out=None):
+  """Same as decompress_video_data, but decodes in-process with PyAV"""
+  import av
+
+  if vid_fmt != "hevc" or pix_fmt not in ("rgb24", "yuv420p"):
+    return decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt, out)
+
+  codec = av.CodecContext.create("hevc", "r")
+  frames = []
+  # parsing None flushes the parser's last packet, decoding None flushes the decoder
+  for packet in [*codec.parse(bytes(rawdat)), *codec.parse(None), None]:
+    frames.extend(codec.decode(packet))
+
+  if out is None:
+    out = np.empty((len(frames), *frame_shape(w, h, pix_fmt)), dtype=np.uint8)
+  assert len(frames) == out.shape[0], (len(frames), out.shape[0])
+  for i, frame in enumerate(frames):
+    out[i] = frame.to_ndarray(format=pix_fmt).reshape(out.shape[1:])
+  return out
+
+
+class DecoderPool:
+  """Decodes GOPs in parallel worker threads. ffmpeg runs in a subprocess and PyAV releases the GIL while decoding"""
+  def __init__(self, num_workers=DECODER_WORKERS, backend=DECODER_BACKEND):
+    assert backend in ("ffmpeg", "av"), backend
+    self.decode = decompress_video_data_av if backend == "av" else decompress_video_data
+    self.pool = ThreadPoolExecutor(max_workers=num_workers)
+
+  def submit(self, rawdat, vid_fmt, w, h, pix_fmt, num_frames):
+    out = np.empty((num_frames, *frame_shape(w, h, pix_fmt)), dtype=np.uint8)
+    return self.pool.submit(self.decode, rawdat, vid_fmt, w, h, pix_fmt, out)
+
+
+_decoder_pool = None
+_decoder_pool_lock = threading.Lock()
+
+def get_decoder_pool():
+  global _decoder_pool
+  with _decoder_pool_lock:
+    if _decoder_pool is None:
+      _decoder_pool = DecoderPool()
+    return _decoder_pool
 
 
 class BaseFrameReader:
@@ -374,10 +462,9 @@ class StreamGOPReader(GOPReader):
     self.num_prefix_frames = 0
     self.vid_fmt = "hevc"
 
-    i = 0
-    while i < self.index.shape[0] and self.index[i, 0] != HEVC_SLICE_I:
-      i += 1
-    self.first_iframe = i
+    # frame numbers of the I-frames, the last row of the index is the end of the file
+    self.iframes = np.flatnonzero(self.index[:-1, 0] == HEVC_SLICE_I)
+    self.first_iframe = self.iframes[0] if len(self.iframes) else self.index.shape[0]
 
     assert self.first_iframe == 0
 
@@ -386,27 +473,33 @@ class StreamGOPReader(GOPReader):
     self.w = probe['streams'][0]['width']
     self.h = probe['streams'][0]['height']
 
-  def _lookup_gop(self, num):
-    frame_b = num
-    while frame_b > 0 and self.index[frame_b, 0] != HEVC_SLICE_I:
-      frame_b -= 1
+  def _lookup_gops(self, nums):
+    # start and end frames of the GOPs containing each frame
+    i = np.searchsorted(self.iframes, nums, side='right')
+    frame_b = np.where(i > 0, self.iframes[np.maximum(i - 1, 0)], 0)
+    frame_e = np.where(i < len(self.iframes), self.iframes[np.minimum(i, len(self.iframes) - 1)], len(self.index) - 1)
+    return frame_b, frame_e
 
-    frame_e = num + 1
-    while frame_e < (len(self.index) - 1) and self.index[frame_e, 0] != HEVC_SLICE_I:
-      frame_e += 1
+  def _lookup_gop(self, num):
+    frame_b, frame_e = (int(x[0]) for x in self._lookup_gops([num]))
 
     offset_b = self.index[frame_b, 1]
     offset_e = self.index[frame_e, 1]
 
     return (frame_b, frame_e, offset_b, offset_e)
 
+  def get_gops(self, nums):
+    frame_b, _ = self._lookup_gops(np.asarray(nums, dtype=np.int64))
+    _, first = np.unique(frame_b, return_index=True)
+    return [self.get_gop(nums[i]) for i in sorted(first)]
+
   def get_gop(self, num):
     frame_b, frame_e, offset_b, offset_e = self._lookup_gop(num)
     assert frame_b <= num < frame_e
 
     num_frames = frame_e - frame_b
 
-    with FileReader(self.fn) as f:
+    with FileReader(self.fn, zero_copy=True) as f:
       f.seek(offset_b)
       rawdat = f.read(offset_e - offset_b)
 
@@ -423,6 +516,64 @@ class StreamGOPReader(GOPReader):
     return frame_b, num_frames, skip_frames, rawdat
 
 
+class FrameCache:
+  """Decoded frames of whole GOPs, bounded in bytes. Least recently used GOPs are evicted first.
+
+  Keyed by file name, so readers of the same video share decoded frames.
+  """
+  def __init__(self, max_bytes=FRAME_CACHE_BYTES):
+    self.max_bytes = max_bytes
+    self.nbytes = 0
+    self.gops: OrderedDict = OrderedDict()  # (fn, pix_fmt, first frame) -> frames
+    self.frame_gops: dict = {}  # (fn, pix_fmt, frame) -> GOP key
+    self.lock = threading.Lock()
+
+  def get(self, fn, pix_fmt, num):
+    with self.lock:
+      key = self.frame_gops.get((fn, pix_fmt, num))
+      if key is None:
+        return None
+      self.gops.move_to_end(key)
+      return self.gops[key][num - key[2]]
+
+  def __contains__(self, key):
+    return key in self.frame_gops
+
+  def put(self, fn, pix_fmt, frame_b, frames):
+    key = (fn, pix_fmt, frame_b)
+    with self.lock:
+      if key in self.gops:
+        return
+      self.gops[key] = frames
+      self.nbytes += frames.nbytes
+      for i in range(frames.shape[0]):
+        self.frame_gops[(fn, pix_fmt, frame_b + i)] = key
+
+      # always keep the newest GOP, even if it's bigger than the budget
+      while self.nbytes > self.max_bytes and len(self.gops) > 1:
+        (old_fn, old_pix_fmt, old_frame_b), old_frames = self.gops.popitem(last=False)
+        self.nbytes -= old_frames.nbytes
+        for i in range(old_frames.shape[0]):
+          del self.frame_gops[(old_fn, old_pix_fmt, old_frame_b + i)]
+
+  def clear(self):
+    with self.lock:
+      self.gops.clear()
+      self.frame_gops.clear()
+      self.nbytes = 0
+
+
+_frame_cache = None
+_frame_cache_lock = threading.Lock()
+
+def get_frame_cache():
+  global _frame_cache
+  with _frame_cache_lock:
+    if _frame_cache is None:
+      _frame_cache = FrameCache()
+    return _frame_cache
+
+
 class GOPFrameReader(BaseFrameReader):
   #FrameReader with caching and readahead for formats that are group-of-picture based
 
@@ -431,12 +582,14 @@ class GOPFrameReader(BaseFrameReader):
 
     self.readahead = readahead
     self.readbehind = readbehind
-    self.frame_cache = LRU(64)
+    self.frame_cache = get_frame_cache()
+    self.access_history: deque = deque(maxlen=2)
 
     if self.readahead:
       self.cache_lock = threading.RLock()
       self.readahead_last = None
       self.readahead_len = 30
+      self.readahead_steps = 4
       self.readahead_c = threading.Condition()
       self.readahead_thread = threading.Thread(target=self._readahead_thread)
       self.readahead_thread.daemon = True
@@ -455,6 +608,22 @@ class GOPFrameReader(BaseFrameReader):
       self.readahead_c.release()
       self.readahead_thread.join()
 
+  def _predict_frames(self):
+    # guess the next frames from the direction and stride of the last two requests
+    num, count = self.access_history[-1]
+    stride = num - self.access_history[0][0] if len(self.access_history) > 1 else 0
+    if stride == 0:
+      stride = -1 if self.readbehind else count
+
+    if stride > 0 and stride <= count:
+      frames = range(num + count, num + count + self.readahead_len)
+    elif stride < 0 and -stride <= self.readahead_len:
+      frames = range(num - 1, num - 1 - self.readahead_len, -1)
+    else:
+      # sparse sampling, prefetch the next few samples
+      frames = range(num + stride, num + stride * (self.readahead_steps + 1), stride)
+    return [k for k in frames if 0 <= k < self.frame_count]
+
   def _readahead_thread(self):
     while True:
       self.readahead_c.acquire()
@@ -467,35 +636,38 @@ class GOPFrameReader(BaseFrameReader):
       if not self.open_:
         break
       assert self.readahead_last
-      num, pix_fmt = self.readahead_last
-
-      if self.readbehind:
-        for k in range(num - 1, max(0, num - self.readahead_len), -1):
-          self._get_one(k, pix_fmt)
+      frames, pix_fmt = self.readahead_last
+
+      with self.cache_lock:
+        self._decode_gops(frames, pix_fmt)
+
+  def _decode_gops(self, nums, pix_fmt):
+    # returns the requested frames, decoding each distinct GOP of the uncached ones once, in parallel, and adding
+    # them to the cache. the cache is shared with other readers, so cached frames are taken from it here too
+    frames = {}
+    uncached = []
+    for num in nums:
+      cached = self.frame_cache.get(self.fn, pix_fmt, num)
+      if cached is None:
+        uncached.append(num)
       else:
-        for k in range(num, min(self.frame_count, num + self.readahead_len)):
-          self._get_one(k, pix_fmt)
-
-  def _get_one(self, num, pix_fmt):
-    assert num < self.frame_count
+        frames[num] = cached
 
-    if (num, pix_fmt) in self.frame_cache:
-      return self.frame_cache[(num, pix_fmt)]
-
-    with self.cache_lock:
-      if (num, pix_fmt) in self.frame_cache:
-        return self.frame_cache[(num, pix_fmt)]
+    pool = get_decoder_pool()
+    futures = []
+    for frame_b, num_frames, skip_frames, rawdat in self.get_gops(uncached):
+      futures.append((frame_b, num_frames, skip_frames, pool.submit(rawdat, self.vid_fmt, self.w, self.h, pix_fmt, skip_frames + num_frames)))
 
-      frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
-
-      ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
-      ret = ret[skip_frames:]
+    for frame_b, num_frames, skip_frames, future in futures:
+      ret = future.result()[skip_frames:]
       assert ret.shape[0] == num_frames
 
+      # cached frames are shared by every reader of the video
+      ret.flags.writeable = False
+      self.frame_cache.put(self.fn, pix_fmt, frame_b, ret)
       for i in range(ret.shape[0]):
-        self.frame_cache[(frame_b+i, pix_fmt)] = ret[i]
-
-      return self.frame_cache[(num, pix_fmt)]
+        frames[frame_b+i] = ret[i]
+    return frames
 
   def get(self, num, count=1, pix_fmt="yuv420p"):
     assert self.frame_count is not None
@@ -506,10 +678,14 @@ class GOPFrameReader(BaseFrameReader):
     if pix_fmt not in ("nv12", "yuv420p", "rgb24", "yuv444p"):
       raise ValueError(f"Unsupported pixel format {pix_fmt!r}")
 
-    ret = [self._get_one(num + i, pix_fmt) for i in range(count)]
+    # the cache may not fit all requested frames, so use the returned ones directly
+    with self.cache_lock:
+      frames = self._decode_gops(range(num, num + count), pix_fmt)
+    ret = [frames[num + i] for i in range(count)]
 
+    self.access_history.append((num, count))
     if self.readahead:
-      self.readahead_last = (num+count, pix_fmt)
+      self.readahead_last = (self._predict_frames(), pix_fmt)
       self.readahead_c.acquire()
       self.readahead_c.notify()
       self.readahead_c.release()
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 import bz2
+import collections
+import concurrent.futures
 from functools import partial
+import heapq
 import multiprocessing
 import capnp
 import enum
 import numpy as np
 import os
 import pathlib
+import pickle
 import re
+import struct
 import sys
 import urllib.parse
 import warnings
@@ -16,13 +21,129 @@ from typing import Iterable, Iterator, List
 from urllib.parse import parse_qs, urlparse
 
 from cereal import log as capnp_log
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.tools.lib.cache import cache_path_for_file_path, DEFAULT_CACHE_DIR
 from openpilot.tools.lib.openpilotci import get_url
-from openpilot.tools.lib.filereader import FileReader, file_exists
+from openpilot.tools.lib.filereader import FileReader, file_exists, resolve_name
 from openpilot.tools.lib.helpers import RE
 from openpilot.tools.lib.route import Route, SegmentRange
 
 LogIterable = Iterable[capnp._DynamicStructReader]
 
+# compressed bytes read from the source per step when streaming
+STREAM_CHUNK_SIZE = 1024 * 1024
+# max number of messages held back to reorder when streaming with sort_by_time
+STREAM_SORT_WINDOW = 10000
+
+LOG_INDEX_VERSION = 2
+LOG_INDEX_DTYPE = np.dtype([('which', np.uint16), ('logMonoTime', np.uint64), ('offset', np.uint64), ('size', np.uint32)])
+
+
+def _filter_union_types(ents: Iterable[capnp._DynamicStructReader]) -> Iterator[capnp._DynamicStructReader]:
+  for ent in ents:
+    try:
+      ent.which()
+      yield ent
+    except capnp.lib.capnp.KjException:
+      pass
+
+
+def _capnp_frame_size(buf: memoryview, offset: int) -> int | None:
+  """Returns the size of the framed capnp message starting at offset, or None if the header is incomplete"""
+  if len(buf) - offset < 4:
+    return None
+  num_segments = struct.unpack_from("<I", buf, offset)[0] + 1
+  header_size = 4 * (num_segments + 1)
+  header_size += header_size % 8
+  if len(buf) - offset < header_size:
+    return None
+  segment_words = struct.unpack_from(f"<{num_segments}I", buf, offset + 4)
+  return header_size + 8 * sum(segment_words)
+
+
+def _read_decompressed_chunks(fn, chunk_size=STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+  with FileReader(fn) as f:
+    decompressor = None
+    first = True
+    while True:
+      dat = f.read(chunk_size)
+      if not dat:
+        break
+
+      if first and dat.startswith(b'BZh'):
+        decompressor = bz2.BZ2Decompressor()
+      first = False
+
+      if decompressor is not None:
+        dat = decompressor.decompress(dat)
+      if dat:
+        yield dat
+
+
+def _source_signature(fn) -> tuple[int, int] | None:
+  """Size and mtime of a local log, to notice when it's rewritten in place. Remote logs don't change, so checking
+  them would only cost a request."""
+  fn = resolve_name(fn)
+  if fn.startswith(("http://", "https://")):
+    return None
+  st = os.stat(fn)
+  return st.st_size, st.st_mtime_ns
+
+
+def build_log_index(dat: bytes) -> dict:
+  """Indexes every event of a decompressed log by type, logMonoTime and byte range"""
+  view = memoryview(dat)
+  offsets = []
+  offset = 0
+  while (size := _capnp_frame_size(view, offset)) is not None and offset + size <= len(dat):
+    offsets.append((offset, size))
+    offset += size
+  view.release()
+
+  services: dict[str, int] = {}
+  index = np.zeros(len(offsets), dtype=LOG_INDEX_DTYPE)
+  n = 0
+  try:
+    for ent, (offset, size) in zip(capnp_log.Event.read_multiple_bytes(dat), offsets, strict=False):
+      try:
+        which = ent.which()
+      except capnp.lib.capnp.KjException:
+        which = ""
+      index[n] = (services.setdefault(which, len(services)), ent.logMonoTime, offset, size)
+      n += 1
+  except capnp.KjException:
+    warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  return {
+    'version': LOG_INDEX_VERSION,
+    'services': list(services),
+    'index': index[:n],
+  }
+
+
+def get_log_index(fn, cache_dir=DEFAULT_CACHE_DIR) -> dict | None:
+  cache_path = cache_path_for_file_path(fn, cache_dir) + ".logindex"
+  if not os.path.exists(cache_path):
+    return None
+
+  with open(cache_path, "rb") as cache_file:
+    log_index = pickle.load(cache_file)
+  if log_index.get('version') != LOG_INDEX_VERSION or log_index.get('source') != _source_signature(fn):
+    return None
+  return log_index
+
+
+def save_log_index(fn, log_index, cache_dir=DEFAULT_CACHE_DIR):
+  cache_path = cache_path_for_file_path(fn, cache_dir) + ".logindex"
+  with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
+    pickle.dump({**log_index, 'source': _source_signature(fn)}, cache_file, -1)
+
+
+def _read_log_bytes(fn) -> bytes:
+  with FileReader(fn, zero_copy=True) as f:
+    dat = f.read()
+  return bz2.decompress(dat) if dat[:3] == b'BZh' else bytes(dat)
+
 
 class _LogFileReader:
   def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
@@ -36,11 +157,13 @@ class _LogFileReader:
         # old rlogs weren't bz2 compressed
         raise Exception(f"unknown extension {ext}")
 
-      with FileReader(fn) as f:
+      with FileReader(fn, zero_copy=True) as f:
         dat = f.read()
 
-    if ext == ".bz2" or dat.startswith(b'BZh9'):
+    if ext == ".bz2" or dat[:4] == b'BZh9':
       dat = bz2.decompress(dat)
+    else:
+      dat = bytes(dat)
 
     ents = capnp_log.Event.read_multiple_bytes(dat)
 
@@ -55,15 +178,212 @@ class _LogFileReader:
     self._ts = [x.logMonoTime for x in self._ents]
 
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
-    for ent in self._ents:
-      if self._only_union_types:
-        try:
-          ent.which()
-          yield ent
-        except capnp.lib.capnp.KjException:
-          pass
-      else:
-        yield ent
+    if self._only_union_types:
+      yield from _filter_union_types(self._ents)
+    else:
+      yield from self._ents
+
+
+class _StreamingLogFileReader:
+  """Reads a log file incrementally, only ever holding a few chunks of it in memory.
+
+  Events are yielded as soon as they are fully decompressed, so iteration can be stopped early without reading
+  the rest of the file. With sort_by_time, events are reordered within a bounded window of sort_window messages.
+  """
+  def __init__(self, fn, only_union_types=False, sort_by_time=False, sort_window=STREAM_SORT_WINDOW, chunk_size=STREAM_CHUNK_SIZE):
+    _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+    if ext not in ('', '.bz2'):
+      # old rlogs weren't bz2 compressed
+      raise Exception(f"unknown extension {ext}")
+
+    self._fn = fn
+    self._only_union_types = only_union_types
+    self._sort_by_time = sort_by_time
+    self._sort_window = sort_window
+    self._chunk_size = chunk_size
+
+  def _read_events(self) -> Iterator[capnp._DynamicStructReader]:
+    buf = b""
+    for chunk in _read_decompressed_chunks(self._fn, self._chunk_size):
+      buf = buf + chunk if buf else chunk
+
+      # find the end of the last complete message in the buffer
+      view = memoryview(buf)
+      end = 0
+      while (size := _capnp_frame_size(view, end)) is not None and end + size <= len(buf):
+        end += size
+      view.release()
+
+      if end == 0:
+        continue
+
+      complete, buf = buf[:end], buf[end:]
+      try:
+        yield from capnp_log.Event.read_multiple_bytes(complete)
+      except capnp.KjException:
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+        return
+
+    if len(buf):
+      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  def _sorted(self, ents: Iterator[capnp._DynamicStructReader]) -> Iterator[capnp._DynamicStructReader]:
+    heap: list = []
+    for i, ent in enumerate(ents):
+      heapq.heappush(heap, (ent.logMonoTime, i, ent))
+      if len(heap) > self._sort_window:
+        yield heapq.heappop(heap)[2]
+
+    while heap:
+      yield heapq.heappop(heap)[2]
+
+  def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
+    ents = self._read_events()
+    if self._sort_by_time:
+      ents = self._sorted(ents)
+    if self._only_union_types:
+      ents = _filter_union_types(ents)
+    yield from ents
+
+
+class _IndexedLogFileReader:
+  """Reads only the events of the requested services and logMonoTime range [start, end).
+
+  The first read of a file decompresses it fully and caches an index of its events. Later reads use the index to
+  skip files without matching events, only build capnp readers for matching events, and stop decompressing after
+  the last one.
+  """
+  def __init__(self, fn, services=None, time_range=None, only_union_types=False, sort_by_time=False, cache_dir=DEFAULT_CACHE_DIR):
+    _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+    if ext not in ('', '.bz2'):
+      # old rlogs weren't bz2 compressed
+      raise Exception(f"unknown extension {ext}")
+
+    self._fn = fn
+    self._services = services
+    self._time_range = time_range
+    self._only_union_types = only_union_types
+    self._sort_by_time = sort_by_time
+    self._cache_dir = cache_dir
+
+  def _select(self, log_index) -> np.ndarray:
+    index = log_index['index']
+    mask = np.ones(len(index), dtype=bool)
+    if self._services is not None:
+      ids = [i for i, s in enumerate(log_index['services']) if s in self._services]
+      mask &= np.isin(index['which'], ids)
+    if self._time_range is not None:
+      start, end = self._time_range
+      if start is not None:
+        mask &= index['logMonoTime'] >= start
+      if end is not None:
+        mask &= index['logMonoTime'] < end
+    return index[mask]
+
+  def _read_events(self, chunks: Iterable[bytes], rows: np.ndarray) -> Iterator[capnp._DynamicStructReader]:
+    offsets, sizes = rows['offset'].astype(int), rows['size'].astype(int)
+    buf, base, i = b"", 0, 0
+    for chunk in chunks:
+      buf = buf + chunk if buf else chunk
+
+      wanted = []
+      while i < len(rows) and offsets[i] + sizes[i] <= base + len(buf):
+        start = offsets[i] - base
+        wanted.append(buf[start:start + sizes[i]])
+        i += 1
+      if len(wanted):
+        yield from capnp_log.Event.read_multiple_bytes(b"".join(wanted))
+      if i == len(rows):
+        return
+
+      # drop everything before the next wanted event
+      drop = min(offsets[i] - base, len(buf)) if i < len(rows) else len(buf)
+      if drop > 0:
+        buf, base = buf[drop:], base + drop
+
+  def _load(self) -> tuple[dict, Iterable[bytes]]:
+    log_index = get_log_index(self._fn, self._cache_dir)
+    if log_index is not None:
+      return log_index, _read_decompressed_chunks(self._fn)
+
+    dat = _read_log_bytes(self._fn)
+    log_index = build_log_index(dat)
+    save_log_index(self._fn, log_index, self._cache_dir)
+    return log_index, [dat]
+
+  def select(self) -> tuple[np.ndarray, Iterator[capnp._DynamicStructReader]]:
+    """Returns the index rows of the matching events, and an iterator over them in file order"""
+    log_index, chunks = self._load()
+    rows = self._select(log_index)
+    return rows, self._read_events(chunks, rows)
+
+  def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
+    rows, ents = self.select()
+    if len(rows) == 0:
+      return
+
+    if self._sort_by_time:
+      ents = sorted(ents, key=lambda x: x.logMonoTime)
+    if self._only_union_types:
+      ents = _filter_union_types(ents)
+    yield from ents
+
+
+def _get_field(msg, field: str):
+  for name in field.split("."):
+    msg = getattr(msg, name)
+  return msg
+
+
+def _column_cache_path(fn, service: str, field: str, cache_dir=DEFAULT_CACHE_DIR) -> str:
+  # columns of a local log that's rewritten in place get a new path
+  signature = _source_signature(fn)
+  suffix = "" if signature is None else ".{}-{}".format(*signature)
+  return cache_path_for_file_path(fn, cache_dir) + f".{service}.{field}{suffix}.npy"
+
+
+def _to_column(name: str, values: list) -> np.ndarray:
+  if len(values) == 0:
+    return np.zeros(0, dtype=np.float64)
+
+  if isinstance(values[0], list) and len({len(v) for v in values}) > 1:
+    raise ValueError(f"{name} is a variable-length list, only fixed-length lists can be read into columns")
+  column = np.asarray(values)
+  if column.dtype.kind not in 'biuf':
+    raise ValueError(f"{name} is not a numeric field ({column.dtype})")
+  return column
+
+
+def read_columns(fn, service: str, fields: List[str], cache=False, cache_dir=DEFAULT_CACHE_DIR) -> dict[str, np.ndarray]:
+  """Reads numeric and fixed-length list fields of a service into arrays, along with each event's logMonoTime.
+
+  Fields are paths relative to the service struct, e.g. "cruiseState.speed". With cache, every column is saved
+  next to the log's index, and later calls memory-map it instead of reading the log.
+  """
+  columns = ['logMonoTime', *fields]
+  paths = {c: _column_cache_path(fn, service, c, cache_dir) for c in columns}
+  if cache and all(os.path.exists(p) for p in paths.values()):
+    return {c: np.load(p, mmap_mode='r') for c, p in paths.items()}
+
+  rows, ents = _IndexedLogFileReader(fn, services=[service], cache_dir=cache_dir).select()
+  values: dict[str, list] = {field: [] for field in fields}
+  for ent in ents:
+    msg = getattr(ent, service)
+    for field in fields:
+      value = _get_field(msg, field)
+      if isinstance(value, capnp.lib.capnp._DynamicListReader):
+        value = list(value)
+      values[field].append(value)
+
+  ret = {'logMonoTime': rows['logMonoTime'].copy()}
+  for field in fields:
+    ret[field] = _to_column(f"{service}.{field}", values[field])
+
+  if cache:
+    for c, p in paths.items():
+      with atomic_write_in_dir(p, mode="wb", overwrite=True) as f:
+        np.save(f, ret[c])
+  return ret
 
 
 class ReadMode(enum.StrEnum):
@@ -175,22 +495,64 @@ class LogReader:
 
     return source(sr, route, mode)
 
-  def __init__(self, identifier: str | List[str], default_mode=ReadMode.RLOG, default_source=auto_source, sort_by_time=False, only_union_types=False):
+  def __init__(self, identifier: str | List[str], default_mode=ReadMode.RLOG, default_source=auto_source, sort_by_time=False, only_union_types=False,
+               streaming=False, services=None, time_range=None, prefetch=0):
     self.default_mode = default_mode
     self.default_source = default_source
     self.identifier = identifier
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
+    self.streaming = streaming
+    self.services = services
+    self.time_range = time_range
+    self.prefetch = prefetch
 
     self.reset()
 
+  def _get_lr(self, identifier):
+    if self.services is not None or self.time_range is not None:
+      return _IndexedLogFileReader(identifier, services=self.services, time_range=self.time_range,
+                                   sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+    if self.streaming:
+      return _StreamingLogFileReader(identifier, sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+    return _LogFileReader(identifier, sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+
+  def _iter_prefetched(self):
+    # download and decompress up to self.prefetch segments ahead in threads (both release the GIL),
+    # while the calling thread parses the current one
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.prefetch)
+    identifiers = iter(self.logreader_identifiers)
+    pending: collections.deque = collections.deque()
+    try:
+      for identifier in identifiers:
+        pending.append((identifier, pool.submit(_read_log_bytes, identifier)))
+        if len(pending) == self.prefetch:
+          break
+
+      while pending:
+        identifier, future = pending.popleft()
+        dat = future.result()
+        next_identifier = next(identifiers, None)
+        if next_identifier is not None:
+          pending.append((next_identifier, pool.submit(_read_log_bytes, next_identifier)))
+
+        yield from _LogFileReader(identifier, sort_by_time=self.sort_by_time, only_union_types=self.only_union_types, dat=dat)
+        del dat
+    finally:
+      # don't wait for segments the consumer stopped before, running downloads finish in the background
+      pool.shutdown(wait=False, cancel_futures=True)
+
   def __iter__(self):
+    if self.prefetch > 0 and not self.streaming and self.services is None and self.time_range is None:
+      yield from self._iter_prefetched()
+      return
+
     for identifier in self.logreader_identifiers:
-      yield from _LogFileReader(identifier)
+      yield from self._get_lr(identifier)
 
   def _run_on_segment(self, func, identifier):
-    lr = _LogFileReader(identifier)
+    lr = self._get_lr(identifier)
     return func(lr)
 
   def run_across_segments(self, num_processes, func):
@@ -200,6 +562,38 @@ class LogReader:
         ret.extend(p)
       return ret
 
+  def to_columns(self, service: str, fields: List[str], cache=False) -> dict[str, np.ndarray]:
+    """Reads fields of a service across all segments into arrays, see read_columns"""
+    segments = [read_columns(identifier, service, fields, cache=cache) for identifier in self.logreader_identifiers]
+    if len(segments) == 1:
+      ret = segments[0]
+    else:
+      ret = {c: np.concatenate([seg[c] for seg in segments]) for c in ['logMonoTime', *fields]}
+
+    if self.time_range is not None:
+      start, end = self.time_range
+      mask = np.ones(len(ret['logMonoTime']), dtype=bool)
+      if start is not None:
+        mask &= ret['logMonoTime'] >= start
+      if end is not None:
+        mask &= ret['logMonoTime'] < end
+      ret = {c: v[mask] for c, v in ret.items()}
+    return ret
+
+  def to_dataframe(self, service: str, fields: List[str], cache=False):
+    """Same as to_columns, as a pandas DataFrame indexed by logMonoTime. List fields are split into field[i] columns"""
+    import pandas as pd
+
+    columns = self.to_columns(service, fields, cache=cache)
+    data = {}
+    for field in fields:
+      if columns[field].ndim == 1:
+        data[field] = columns[field]
+      else:
+        for i in range(columns[field].shape[1]):
+          data[f"{field}[{i}]"] = columns[field][:, i]
+    return pd.DataFrame(data, index=pd.Index(columns['logMonoTime'], name='logMonoTime'))
+
   def reset(self):
     self.logreader_identifiers = self._parse_identifiers(self.identifier)
 
@@ -2,13 +2,15 @@
 from functools import wraps
 import http.server
 import os
+import tempfile
 import threading
 import time
 import unittest
+from unittest.mock import patch
 
 from parameterized import parameterized
 
-from openpilot.tools.lib.url_file import URLFile
+from openpilot.tools.lib.url_file import URLFile, prune_cache
 
 
 class CachingTestRequestHandler(http.server.BaseHTTPRequestHandler):
@@ -108,6 +110,25 @@ class TestFileDownload(unittest.TestCase):
     self.compare_loads(large_file_url, length - 100, 100)
     self.compare_loads(large_file_url)
 
+  def test_large_file_serial(self):
+    large_file_url = "https://commadataci.blob.core.windows.net/openpilotci/0375fdf7b1ce594d/2019-06-13--08-32-25/3/qlog.bz2"
+    parallel = URLFile(large_file_url, cache=False).read()
+
+    with tempfile.TemporaryDirectory() as cache_dir, patch.dict(os.environ, {"COMMA_CACHE": cache_dir}):
+      self.assertEqual(URLFile(large_file_url, cache=True, num_workers=1).read(), parallel)
+      self.assertEqual(URLFile(large_file_url, cache=True, num_workers=4).read(), parallel)
+
+  def test_prune_cache(self):
+    with tempfile.TemporaryDirectory() as cache_dir:
+      for i in range(10):
+        fn = os.path.join(cache_dir, str(i))
+        with open(fn, "wb") as f:
+          f.write(b"\x00" * 100)
+        os.utime(fn, (i, i))
+
+      prune_cache(cache_dir, max_size=450)
+      self.assertListEqual(sorted(os.listdir(cache_dir), key=int), [str(i) for i in range(6, 10)])
+
   @parameterized.expand([(True, ), (False, )])
   @with_caching_server
   def test_recover_from_missing_file(self, cache_enabled, port):
@@ -1,3 +1,5 @@
+from itertools import islice
+import os
 import shutil
 import tempfile
 import numpy as np
@@ -5,7 +7,8 @@ import unittest
 import pytest
 from parameterized import parameterized
 import requests
-from openpilot.tools.lib.logreader import LogReader, parse_indirect, parse_slice, ReadMode
+from openpilot.tools.lib.cache import cache_path_for_file_path
+from openpilot.tools.lib.logreader import LOG_INDEX_VERSION, LogReader, _to_column, get_log_index, parse_indirect, parse_slice, save_log_index, ReadMode
 from openpilot.tools.lib.route import Route, SegmentRange
 
 NUM_SEGS = 17 # number of segments in the test route
@@ -57,6 +60,68 @@ class TestLogReader(unittest.TestCase):
       l = len(list(LogReader(f)))
       self.assertGreater(l, 100)
 
+  def test_streaming(self):
+    msgs = list(LogReader(QLOG_FILE))
+    streamed = list(LogReader(QLOG_FILE, streaming=True))
+    self.assertEqual(len(msgs), len(streamed))
+    self.assertListEqual([m.as_builder().to_bytes() for m in msgs], [m.as_builder().to_bytes() for m in streamed])
+
+    # stops reading as soon as the consumer does
+    first = list(islice(LogReader(QLOG_FILE, streaming=True), 10))
+    self.assertListEqual([m.logMonoTime for m in first], [m.logMonoTime for m in msgs[:10]])
+
+  def test_streaming_sort_by_time(self):
+    msgs = list(LogReader(QLOG_FILE, sort_by_time=True))
+    streamed = list(LogReader(QLOG_FILE, sort_by_time=True, streaming=True))
+    self.assertListEqual([m.logMonoTime for m in msgs], [m.logMonoTime for m in streamed])
+
+  def test_services(self):
+    services = ['carState', 'controlsState']
+    msgs = [m for m in LogReader(QLOG_FILE) if m.which() in services]
+    start, end = msgs[10].logMonoTime, msgs[-10].logMonoTime
+
+    index_path = cache_path_for_file_path(QLOG_FILE) + ".logindex"
+    if os.path.exists(index_path):
+      os.remove(index_path)
+
+    # first read builds the index, second one uses it
+    for _ in range(2):
+      filtered = list(LogReader(QLOG_FILE, services=services))
+      self.assertListEqual([m.logMonoTime for m in filtered], [m.logMonoTime for m in msgs])
+      self.assertTrue(os.path.exists(index_path))
+
+    filtered = list(LogReader(QLOG_FILE, services=services, time_range=(start, end)))
+    self.assertListEqual([m.logMonoTime for m in filtered], [m.logMonoTime for m in msgs if start <= m.logMonoTime < end])
+
+  def test_log_index_rewritten_file(self):
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.NamedTemporaryFile(mode='wb') as f:
+      f.write(b'log')
+      f.flush()
+      log_index = {'version': LOG_INDEX_VERSION, 'services': [], 'index': np.zeros(0)}
+      save_log_index(f.name, log_index, cache_dir)
+      self.assertIsNotNone(get_log_index(f.name, cache_dir))
+
+      # rewriting the log in place invalidates its index
+      f.write(b'rewritten')
+      f.flush()
+      self.assertIsNone(get_log_index(f.name, cache_dir))
+
+  def test_to_columns(self):
+    msgs = [m for m in LogReader(QLOG_FILE) if m.which() == 'carState']
+
+    for cache in (False, True, True):
+      columns = LogReader(QLOG_FILE).to_columns('carState', ['vEgo', 'cruiseState.speed'], cache=cache)
+      np.testing.assert_array_equal(columns['logMonoTime'], [m.logMonoTime for m in msgs])
+      np.testing.assert_array_equal(columns['vEgo'], [m.carState.vEgo for m in msgs])
+      np.testing.assert_array_equal(columns['cruiseState.speed'], [m.carState.cruiseState.speed for m in msgs])
+
+  def test_to_column(self):
+    np.testing.assert_array_equal(_to_column("s.f", [[1., 2.], [3., 4.]]), [[1., 2.], [3., 4.]])
+    self.assertEqual(_to_column("s.f", []).shape, (0,))
+    for values in ([[], [1.]], [[1., 2.], [3.]]):
+      with self.assertRaisesRegex(ValueError, "variable-length"):
+        _to_column("s.f", values)
+
   @parameterized.expand([
     (f"{TEST_ROUTE}///",),
     (f"{TEST_ROUTE}---",),
@@ -92,6 +157,13 @@ class TestLogReader(unittest.TestCase):
 
     self.assertEqual(qlog_len*2, qlog_len_2)
 
+  @pytest.mark.slow
+  def test_prefetch(self):
+    segments = f"{TEST_ROUTE}/0:3/q"
+    msgs = [m.logMonoTime for m in LogReader(segments)]
+    for prefetch in (1, 2, 4):
+      self.assertListEqual(msgs, [m.logMonoTime for m in LogReader(segments, prefetch=prefetch)])
+
   @pytest.mark.slow
   def test_multiple_iterations(self):
     lr = LogReader(f"{TEST_ROUTE}/0/q")
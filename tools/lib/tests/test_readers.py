@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 import unittest
+from unittest.mock import MagicMock, patch
 import requests
 import tempfile
 
 from collections import defaultdict
 import numpy as np
-from openpilot.tools.lib.framereader import FrameReader
+from openpilot.tools.lib.filereader import FileReader
+from openpilot.tools.lib import framereader
+from openpilot.tools.lib.framereader import DecoderPool, FrameCache, FrameReader, FrameType, StreamGOPReader, HEVC_SLICE_I, HEVC_SLICE_P
 from openpilot.tools.lib.logreader import LogReader
 
 
@@ -63,5 +66,108 @@ class TestReaders(unittest.TestCase):
     fr_url = FrameReader("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/video.hevc?raw=true")
     _check_data(fr_url)
 
+  def test_decoder_backends(self):
+    import av
+    w, h, n = 320, 240, 50
+
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as fp:
+      with av.open(fp.name, "w", format="hevc") as out:
+        stream = out.add_stream("libx265", rate=20)
+        stream.width, stream.height, stream.pix_fmt = w, h, "yuv420p"
+        stream.options = {"x265-params": "keyint=20:min-keyint=20:bframes=0:scenecut=0:log-level=error"}
+        for i in range(n):
+          img = np.full((h, w, 3), i * 4, dtype=np.uint8)
+          for packet in stream.encode(av.VideoFrame.from_ndarray(img, format="rgb24")):
+            out.mux(packet)
+        for packet in stream.encode():
+          out.mux(packet)
+
+      frames = {}
+      for backend in ("ffmpeg", "av"):
+        with patch.object(framereader, "_decoder_pool", DecoderPool(num_workers=4, backend=backend)):
+          fr = FrameReader(fp.name, cache_dir=tempfile.mkdtemp())
+          fr.frame_cache.clear()
+          self.assertEqual(fr.frame_count, n)
+
+          # decoding many GOPs at once matches decoding them one frame at a time
+          frames[backend] = fr.get(0, n, pix_fmt="yuv420p")
+          fr.frame_cache.clear()
+          for i in range(n):
+            np.testing.assert_array_equal(fr.get(i, 1, pix_fmt="yuv420p")[0], frames[backend][i])
+
+      for a, b in zip(frames["ffmpeg"], frames["av"], strict=True):
+        np.testing.assert_array_equal(a, b)
+
+  def test_frame_cache(self):
+    cache = FrameCache(max_bytes=3 * 10 * 100)
+    for frame_b in range(0, 40, 10):
+      cache.put("video", "yuv420p", frame_b, np.full((10, 100), frame_b, dtype=np.uint8))
+      # touch the first GOP so it's not evicted
+      self.assertIsNotNone(cache.get("video", "yuv420p", 5))
+
+    # the least recently used GOP was evicted as a whole
+    self.assertEqual(cache.nbytes, 3 * 10 * 100)
+    self.assertEqual(len(cache.gops), 3)
+    for num in range(10, 20):
+      self.assertIsNone(cache.get("video", "yuv420p", num))
+    self.assertIsNone(cache.get("video", "rgb24", 5))
+    self.assertEqual(cache.get("video", "yuv420p", 35)[0], 30)
+
+  def test_gop_lookup(self):
+    iframes = [0, 20, 25, 60]
+    frame_types = [HEVC_SLICE_I if i in iframes else HEVC_SLICE_P for i in range(80)]
+    index = np.array([(t, i * 100) for i, t in enumerate(frame_types)] + [(0xFFFFFFFF, 8000)], dtype=np.uint32)
+    probe = {'streams': [{'width': 4, 'height': 4}]}
+    reader = StreamGOPReader("video.hevc", FrameType.h265_stream, {'index': index, 'global_prefix': b"", 'probe': probe})
+
+    for num in range(80):
+      frame_b = max(i for i in iframes if i <= num)
+      frame_e = min([i for i in iframes if i > num] + [80])
+      self.assertEqual(reader._lookup_gop(num), (frame_b, frame_e, frame_b * 100, frame_e * 100))
+
+    with patch.object(reader, "get_gop", side_effect=lambda num: reader._lookup_gop(num)[:2]):
+      gops = reader.get_gops([61, 3, 21, 79, 0, 24, 30])
+    self.assertEqual(gops, [(60, 80), (0, 20), (20, 25), (25, 60)])
+
+  def test_shared_frame_cache(self):
+    frame_types = [HEVC_SLICE_I if i in (0, 20) else HEVC_SLICE_P for i in range(25)]
+    index = np.array([(t, i * 100) for i, t in enumerate(frame_types)] + [(0xFFFFFFFF, 2500)], dtype=np.uint32)
+    probe = {'streams': [{'width': 4, 'height': 4}]}
+    reader = framereader.StreamFrameReader("video.hevc", FrameType.h265_stream, {'index': index, 'global_prefix': b"", 'probe': probe})
+    reader.frame_cache = FrameCache()
+
+    # first GOP was already decoded by another reader of the same video
+    reader.frame_cache.put("video.hevc", "yuv420p", 0, np.zeros((20, 24), dtype=np.uint8))
+
+    pool = MagicMock()
+    pool.submit.return_value.result.return_value = np.ones((5, 24), dtype=np.uint8)
+    with patch.object(framereader, "get_decoder_pool", return_value=pool), \
+         patch.object(reader, "get_gops", return_value=[(20, 5, 0, b"")]) as get_gops:
+      frames = reader.get(18, count=4)
+
+    get_gops.assert_called_once_with([20, 21])
+    self.assertEqual([f[0] for f in frames], [0, 0, 1, 1])
+    # cached frames can't be modified by one reader for the others
+    self.assertFalse(frames[2].flags.writeable)
+    self.assertEqual(reader.frame_cache.get("video.hevc", "yuv420p", 21)[0], 1)
+
+  def test_zero_copy_filereader(self):
+    dat = np.random.bytes(10000)
+    with tempfile.NamedTemporaryFile() as fp:
+      fp.write(dat)
+      fp.flush()
+
+      with FileReader(fp.name, zero_copy=True) as f:
+        f.seek(100)
+        head = f.read(1000)
+        tail = f.read()
+        self.assertIsInstance(head, memoryview)
+        self.assertEqual(head, dat[100:1100])
+        self.assertEqual(tail, dat[1100:])
+        self.assertEqual(len(f.read()), 0)
+
+      # views stay valid after the reader is closed
+      self.assertEqual(head, dat[100:1100])
+
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import tempfile
+import unittest
+
+from parameterized import parameterized
+
+from openpilot.tools.lib.vidindex import VideoFileInvalid, hevc_index, hevc_index_chunks
+
+VPS = b"\x00\x00\x01\x40\x01\x0c\x01\x00"
+SPS = b"\x00\x00\x01\x42\x01\x01\x02\x00"
+PPS = b"\x00\x00\x01\x44\x01\xc1\x00"
+I_SLICE = b"\x00\x00\x01\x26\x01\xae\x12\x34"  # IDR_W_RADL, first slice, slice_type 2
+P_SLICE = b"\x00\x00\x01\x02\x01\xd4\x55"  # TRAIL_R, first slice, slice_type 1
+P_SLICE_2 = b"\x00\x00\x01\x02\x01\x40\x66"  # TRAIL_R, not the first slice of the picture
+SEI = b"\x00\x00\x01\x4e\x01\x05\x02"
+B_SLICE = b"\x00\x00\x01\x00\x01\xf0"  # TRAIL_N, first slice, slice_type 0
+
+NAL_UNITS = [VPS, SPS, PPS, I_SLICE, SEI, P_SLICE, P_SLICE_2, B_SLICE]
+VIDEO = b"\x00" + b"".join(NAL_UNITS)
+
+
+class TestVidIndex(unittest.TestCase):
+  def expected(self):
+    offsets = [1 + sum(len(n) for n in NAL_UNITS[:i]) for i in range(len(NAL_UNITS))]
+    frame_types = [(2, offsets[3]), (1, offsets[5]), (0, offsets[7])]
+    return frame_types, len(VIDEO), VPS + SPS + PPS
+
+  def test_hevc_index(self):
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as f:
+      f.write(VIDEO)
+      f.flush()
+      self.assertEqual(hevc_index(f.name), self.expected())
+
+  @parameterized.expand([(1,), (2,), (3,), (5,), (16,), (len(VIDEO),)])
+  def test_chunked(self, chunk_size):
+    chunks = (VIDEO[i:i + chunk_size] for i in range(0, len(VIDEO), chunk_size))
+    self.assertEqual(hevc_index_chunks(chunks), self.expected())
+
+  def test_invalid(self):
+    with self.assertRaises(VideoFileInvalid):
+      hevc_index_chunks([b"\x00\x00"])
+    with self.assertRaises(VideoFileInvalid):
+      hevc_index_chunks([b"\x01" + VIDEO[1:]])
+    with self.assertRaises(VideoFileInvalid):
+      hevc_index_chunks([b"\x00\x01" + VIDEO[1:]])
+
+  def test_allow_corrupt(self):
+    # truncated slice segment header in the last slice
+    video = VIDEO + b"\x00\x00\x01\x02\x01\xc2"
+    with self.assertRaises(VideoFileInvalid):
+      hevc_index_chunks([video])
+
+    frame_types, dat_len, prefix = hevc_index_chunks([video], allow_corrupt=True)
+    self.assertEqual((frame_types, dat_len, prefix), (self.expected()[0], len(video), self.expected()[2]))
+
+
+if __name__ == "__main__":
+  unittest.main()
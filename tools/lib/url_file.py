@@ -1,6 +1,8 @@
+import mmap
 import os
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 from urllib3 import PoolManager
 from urllib3.util import Timeout
@@ -11,6 +13,12 @@ from openpilot.system.hardware.hw import Paths
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
+#  Number of chunks downloaded in parallel
+NUM_WORKERS = int(os.environ.get("FILEREADER_NUM_WORKERS", "8"))
+#  Max size of the download cache, least recently used chunks are evicted past it
+CACHE_SIZE = int(float(os.environ.get("FILEREADER_CACHE_SIZE_GB", "50")) * 1e9)
+#  Check the cache size every time this many chunks were downloaded
+PRUNE_INTERVAL = 64
 
 
 def hash_256(link):
@@ -18,15 +26,53 @@ def hash_256(link):
   return hsh
 
 
+def map_file(path):
+  """Read-only memory map of a whole file. The map stays open as long as it, or a memoryview of it, is referenced"""
+  with open(path, "rb") as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def prune_cache(cache_dir, max_size=CACHE_SIZE):
+  """Deletes the least recently used files in cache_dir until it's smaller than max_size"""
+  try:
+    entries = [e for e in os.scandir(cache_dir) if e.is_file(follow_symlinks=False)]
+  except FileNotFoundError:
+    return
+
+  stats = []
+  for e in entries:
+    try:
+      st = e.stat()
+    except OSError:
+      continue  # deleted by another reader while scanning
+    stats.append((st.st_mtime, st.st_size, e.path))
+  total_size = sum(size for _, size, _ in stats)
+  for _, size, path in sorted(stats):
+    if total_size <= max_size:
+      break
+    try:
+      os.remove(path)
+      total_size -= size
+    except FileNotFoundError:
+      pass
+
+
 class URLFileException(Exception):
   pass
 
 
 class URLFile:
   _tlocal = threading.local()
+  _prune_lock = threading.Lock()
+  _chunks_since_prune = PRUNE_INTERVAL
 
-  def __init__(self, url, debug=False, cache=None):
+  def __init__(self, url, debug=False, cache=None, num_workers=NUM_WORKERS, zero_copy=False):
     self._url = url
+    self._num_workers = num_workers
+    #  If set, read returns memoryviews, which reference the cached chunks directly when the range is within one chunk
+    self._zero_copy = zero_copy
     self._pos = 0
     self._length = None
     self._local_file = None
@@ -39,10 +85,12 @@ class URLFile:
     if not self._force_download:
       os.makedirs(Paths.download_cache_root(), exist_ok=True)
 
-    try:
-      self._http_client = URLFile._tlocal.http_client
-    except AttributeError:
-      self._http_client = URLFile._tlocal.http_client = PoolManager()
+    # one pool per thread and size, big enough for every worker to keep its connection
+    if not hasattr(URLFile._tlocal, "http_clients"):
+      URLFile._tlocal.http_clients = {}
+    if num_workers not in URLFile._tlocal.http_clients:
+      URLFile._tlocal.http_clients[num_workers] = PoolManager(maxsize=num_workers)
+    self._http_client = URLFile._tlocal.http_clients[num_workers]
 
   def __enter__(self):
     return self
@@ -81,48 +129,82 @@ class URLFile:
 
   def read(self, ll=None):
     if self._force_download:
-      return self.read_aux(ll=ll)
+      ret = self.read_aux(ll=ll)
+      return memoryview(ret) if self._zero_copy else ret
 
+    length = self.get_length()
+    assert length != -1, f"Remote file is empty or doesn't exist: {self._url}"
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
-
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
+    file_end = min(self._pos + ll, length) if ll is not None else length
+    if file_begin >= file_end:
+      return memoryview(b"") if self._zero_copy else b""
+
+    #  We have to align with chunks we store. Positions are the beginnings of the chunks overlapping our range
+    positions = range((file_begin // CHUNK_SIZE) * CHUNK_SIZE, file_end, CHUNK_SIZE)
+    chunks = {}
+    missing = []
+    for position in positions:
+      full_path = self._chunk_path(position)
+      try:
+        chunks[position] = map_file(full_path)
+        # mark as recently used for cache eviction
+        os.utime(full_path)
+      except FileNotFoundError:
+        missing.append(position)
+
+    #  Download missing chunks concurrently
+    if len(missing) > 1 and self._num_workers > 1:
+      with ThreadPoolExecutor(max_workers=min(self._num_workers, len(missing))) as pool:
+        chunks.update(zip(missing, pool.map(self._download_chunk, missing), strict=True))
+    else:
+      chunks.update((position, self._download_chunk(position)) for position in missing)
+
+    if len(missing):
+      self._maybe_prune_cache(len(missing))
+
+    views = [memoryview(chunks[position])[max(0, file_begin - position): file_end - position] for position in positions]
+    self._pos = file_end
+    if self._zero_copy:
+      return views[0] if len(views) == 1 else memoryview(b"".join(views))
+    return b"".join(views)
+
+  def _chunk_path(self, position):
+    chunk_number = position / CHUNK_SIZE
+    file_name = hash_256(self._url) + "_" + str(chunk_number)
+    return os.path.join(Paths.download_cache_root(), str(file_name))
+
+  def _download_chunk(self, position):
+    data = self.read_range(position, CHUNK_SIZE)
+    with atomic_write_in_dir(self._chunk_path(position), mode="wb", overwrite=True) as new_cached_file:
+      new_cached_file.write(data)
+    return data
+
+  @staticmethod
+  def _maybe_prune_cache(num_chunks):
+    with URLFile._prune_lock:
+      URLFile._chunks_since_prune += num_chunks
+      if URLFile._chunks_since_prune < PRUNE_INTERVAL:
+        return
+      URLFile._chunks_since_prune = 0
+      prune_cache(Paths.download_cache_root())
 
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+  def read_aux(self, ll=None):
+    ret = self.read_range(self._pos, ll)
+    self._pos += len(ret)
+    return ret
 
   @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
-  def read_aux(self, ll=None):
+  def read_range(self, pos, ll=None):
     download_range = False
     headers = {'Connection': 'keep-alive'}
-    if self._pos != 0 or ll is not None:
+    if pos != 0 or ll is not None:
       if ll is None:
         end = self.get_length() - 1
       else:
-        end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
+        end = min(pos + ll, self.get_length()) - 1
+      if pos > end:
         return b""
-      headers['Range'] = f"bytes={self._pos}-{end}"
+      headers['Range'] = f"bytes={pos}-{end}"
       download_range = True
 
     if self._debug:
@@ -145,7 +227,6 @@ class URLFile:
     if (not download_range) and response_code != 200:  # OK
       raise URLFileException(f"Error {response_code} {headers} ({self._url}): {repr(ret)[:500]}")
 
-    self._pos += len(ret)
     return ret
 
   def seek(self, pos):
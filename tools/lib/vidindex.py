@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 import argparse
+import collections
 import os
 import struct
 from enum import IntEnum
-from typing import Tuple
+from typing import Iterator, List, Tuple
 
 from openpilot.tools.lib.filereader import FileReader
 
@@ -18,6 +19,10 @@ DEBUG = int(os.getenv("DEBUG", "0"))
 NAL_UNIT_START_CODE = b"\x00\x00\x01"
 NAL_UNIT_START_CODE_SIZE = len(NAL_UNIT_START_CODE)
 NAL_UNIT_HEADER_SIZE = 2
+# bytes from the start code enough to parse a slice segment header up to slice_type
+SLICE_HEADER_PARSE_SIZE = NAL_UNIT_START_CODE_SIZE + NAL_UNIT_HEADER_SIZE + 16
+# bytes read from the video at a time while indexing
+HEVC_INDEX_CHUNK_SIZE = 8 * 1024 * 1024
 
 class HevcNalUnitType(IntEnum):
   TRAIL_N = 0         # RBSP structure: slice_segment_layer_rbsp( )
@@ -259,9 +264,30 @@ def get_hevc_slice_type(dat: bytes, nal_unit_start: int, nal_unit_type: HevcNalU
     raise VideoFileInvalid("slice_type must be 0, 1, or 2")
   return slice_type, is_first_slice
 
+def find_nal_unit_starts(dat: bytes, start: int = 0) -> List[int]:
+  # bytes.find scans in C, so python only runs once per NAL unit
+  starts = []
+  pos = dat.find(NAL_UNIT_START_CODE, start)
+  while pos != -1:
+    starts.append(pos)
+    pos = dat.find(NAL_UNIT_START_CODE, pos + NAL_UNIT_START_CODE_SIZE)
+  return starts
+
 def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> Tuple[list, int, bytes]:
-  with FileReader(hevc_file_name) as f:
-    dat = f.read()
+  with FileReader(hevc_file_name, zero_copy=True) as f:
+    return hevc_index_chunks(iter(lambda: f.read(HEVC_INDEX_CHUNK_SIZE), b""), allow_corrupt)
+
+def hevc_index_chunks(chunks: Iterator[bytes], allow_corrupt: bool=False) -> Tuple[list, int, bytes]:
+  """Indexes a stream given as consecutive chunks, only keeping the unprocessed tail of it in memory.
+
+  Only the first bytes of slice segment NAL units are parsed, and only the parameter sets are copied.
+  """
+  chunks = iter(chunks)
+  dat = b""
+  for chunk in chunks:
+    dat += chunk
+    if len(dat) >= NAL_UNIT_START_CODE_SIZE + 1:
+      break
 
   if len(dat) < NAL_UNIT_START_CODE_SIZE + 1:
     raise VideoFileInvalid("data is too short")
@@ -272,25 +298,66 @@ def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> Tuple[list, in
   prefix_dat = b""
   frame_types = list()
 
-  i = 1 # skip past first byte 0x00
-  try:
-    while i < len(dat):
-      require_nal_unit_start(dat, i)
-      nal_unit_len = get_hevc_nal_unit_length(dat, i)
-      nal_unit_type = get_hevc_nal_unit_type(dat, i)
+  buf = b""  # unprocessed data, starting at offset base in the stream
+  base = 0
+  pending: collections.deque = collections.deque()  # starts of NAL units not processed yet
+  last_start = 0
+  eof = False
+
+  def process_pending() -> None:
+    nonlocal prefix_dat
+    buf_end = base + len(buf)
+    while len(pending):
+      i = pending[0]
+      if not eof and buf_end < i + NAL_UNIT_START_CODE_SIZE + NAL_UNIT_HEADER_SIZE:
+        return
+
+      nal_unit_type = get_hevc_nal_unit_type(buf, i - base)
       if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
-        prefix_dat += dat[i:i+nal_unit_len]
+        # needs the whole NAL unit, up to the next start code
+        if len(pending) < 2 and not eof:
+          return
+        nal_unit_end = pending[1] if len(pending) > 1 else buf_end
+        if DEBUG:
+          print("  nal_unit_len:", nal_unit_end - i)
+        prefix_dat += buf[i - base:nal_unit_end - base]
       elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
-        slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
+        # needs enough of the slice segment header to get the slice type
+        if not eof and buf_end < i + SLICE_HEADER_PARSE_SIZE:
+          return
+        slice_type, is_first_slice = get_hevc_slice_type(buf[i - base:i - base + SLICE_HEADER_PARSE_SIZE], 0, nal_unit_type)
         if is_first_slice:
           frame_types.append((slice_type, i))
-      i += nal_unit_len
+      pending.popleft()
+
+  def feed(dat: bytes) -> None:
+    nonlocal buf, base, last_start
+    buf = buf + dat if len(buf) else bytes(dat)
+    for start in find_nal_unit_starts(buf, max(last_start + 1 - base, 0)):
+      pending.append(start + base)
+      last_start = start + base
+    process_pending()
+
+    # keep what's still needed, and enough to find start codes over the chunk boundary
+    keep_from = pending[0] if len(pending) else base + len(buf) - (NAL_UNIT_START_CODE_SIZE - 1)
+    if keep_from > base:
+      buf, base = buf[keep_from - base:], keep_from
+
+  try:
+    require_nal_unit_start(dat, 1) # skip past first byte 0x00
+    feed(dat)
+    for chunk in chunks:
+      feed(chunk)
+
+    eof = True
+    process_pending()
   except Exception as e:
     if not allow_corrupt:
       raise
-    print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
+    print(f"ERROR: NAL unit skipped @ {pending[0] if len(pending) else base}\n", str(e))
 
-  return frame_types, len(dat), prefix_dat
+  dat_len = base + len(buf) + sum(len(chunk) for chunk in chunks)
+  return frame_types, dat_len, prefix_dat
 
 def main() -> None:
   parser = argparse.ArgumentParser()